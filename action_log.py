@@ -0,0 +1,159 @@
+"""
+ Buffered writer for user_actions. Handlers only enqueue events, a background thread inserts them
+ with one multi-row insert when the batch is full or the flush interval passes.
+ user_daily_stats rollup is updated in the same transaction, so /stats never scans user_actions
+"""
+import logging
+import queue
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+from psycopg2.extras import execute_values
+
+import config
+import db
+
+logger = logging.getLogger(__name__)
+
+# actions counted in user_daily_stats
+ROLLUP_ACTIONS = ('win', 'lose', 'translation_mastered', 'add_word', 'add_manual')
+ROLLUP_COLUMNS = """count(case when action = 'win' then 1 end),
+                    count(case when action = 'lose' then 1 end),
+                    count(case when action = 'translation_mastered' then 1 end),
+                    count(case when action in ('add_word', 'add_manual') then 1 end)"""
+
+_queue = queue.Queue()
+_wakeup = threading.Event()
+_flush_lock = threading.Lock()
+_thread = None
+_thread_lock = threading.Lock()
+_retry = []  # events of a failed flush, written with the next batch
+_unflushed = {}  # uid -> Counter of rollup actions recorded but not committed yet
+_unflushed_lock = threading.Lock()
+_metrics = {'flushed': 0, 'dropped': 0, 'flushes': 0, 'last_flush_seconds': 0.0, 'max_flush_seconds': 0.0}
+
+
+def record(uid, action: str):
+    """ Enqueue action, dttm is the time of the call and not of the flush """
+    uid = str(uid)
+    if action in ROLLUP_ACTIONS:
+        with _unflushed_lock:
+            _unflushed.setdefault(uid, Counter())[action] += 1
+    _queue.put((uid, action, datetime.now(timezone.utc)))
+    _ensure_thread()
+    if _queue.qsize() >= config.ACTION_LOG_BATCH_SIZE:
+        _wakeup.set()
+
+
+def _ensure_thread():
+    global _thread
+    if _thread is None:
+        with _thread_lock:
+            if _thread is None:
+                _thread = threading.Thread(target=_run, name='action_log', daemon=True)
+                _thread.start()
+
+
+def _run():
+    while True:
+        _wakeup.wait(config.ACTION_LOG_FLUSH_INTERVAL)
+        _wakeup.clear()
+        try:
+            flush()
+        except Exception:
+            logger.exception('user_actions flush failed')
+
+
+def flush():
+    """ Write every queued event now. Called by the background thread and before shutdown """
+    with _flush_lock:
+        batch = _retry[:]
+        del _retry[:]
+        while True:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        if not batch:
+            return
+        started = time.monotonic()
+        try:
+            with db.transaction() as cursor:
+                execute_values(cursor, "insert into user_actions (uid, action, dttm) values %s", batch,
+                               page_size=config.ACTION_LOG_BATCH_SIZE)
+                _update_rollup(cursor, [event for event in batch if event[1] in ROLLUP_ACTIONS])
+        except Exception:
+            keep = batch[-config.ACTION_LOG_MAX_BUFFER:]
+            _metrics['dropped'] += len(batch) - len(keep)
+            _forget(batch[:len(batch) - len(keep)])
+            _retry.extend(keep)
+            raise
+        _forget(batch)
+        elapsed = time.monotonic() - started
+        _metrics['flushed'] += len(batch)
+        _metrics['flushes'] += 1
+        _metrics['last_flush_seconds'] = elapsed
+        _metrics['max_flush_seconds'] = max(_metrics['max_flush_seconds'], elapsed)
+
+
+def _forget(events):
+    """ Take written or dropped events out of the unflushed counts """
+    with _unflushed_lock:
+        for uid, action, _ in events:
+            counts = _unflushed.get(uid)
+            if counts is None or action not in counts:
+                continue
+            counts[action] -= 1
+            if counts[action] <= 0:
+                del counts[action]
+            if not counts:
+                del _unflushed[uid]
+
+
+def unflushed(uid) -> dict:
+    """ Rollup actions of the user that are still buffered, /stats adds them to user_daily_stats """
+    with _unflushed_lock:
+        return dict(_unflushed.get(str(uid), ()))
+
+
+def _update_rollup(cursor, events):
+    if not events:
+        return
+    # all events go in one statement, otherwise a page of execute_values could be counted separately
+    execute_values(cursor, f"""insert into user_daily_stats (uid, day, wins, losses, mastered, added)
+                               select uid, dttm::timestamp::date, {ROLLUP_COLUMNS}
+                               from (values %s) as events (uid, action, dttm)
+                               group by 1, 2
+                               on conflict (uid, day) do update
+                                 set wins = user_daily_stats.wins + excluded.wins,
+                                     losses = user_daily_stats.losses + excluded.losses,
+                                     mastered = user_daily_stats.mastered + excluded.mastered,
+                                     added = user_daily_stats.added + excluded.added;""",
+                   events, template='(%s, %s, %s::timestamptz)', page_size=len(events))
+
+
+def backfill_rollup():
+    """
+    Rebuild user_daily_stats from user_actions history before today. Safe to run again, counts are overwritten.
+    It runs as its own process next to the bot, so today's rows are left to the bot's increments: overwriting them
+    could erase events the bot commits while the backfill runs
+    """
+    with db.transaction() as cursor:
+        cursor.execute(f"""insert into user_daily_stats (uid, day, wins, losses, mastered, added)
+                           select uid, dttm::date, {ROLLUP_COLUMNS}
+                           from user_actions
+                           where action in %s and dttm < current_date
+                           group by 1, 2
+                           on conflict (uid, day) do update
+                             set wins = excluded.wins,
+                                 losses = excluded.losses,
+                                 mastered = excluded.mastered,
+                                 added = excluded.added;""", (ROLLUP_ACTIONS,))
+        return cursor.rowcount
+
+
+def stats() -> dict:
+    """ Queue depth and flush latency """
+    return dict(_metrics, queue_depth=_queue.qsize() + len(_retry))
@@ -0,0 +1,9 @@
+"""
+ Fill user_daily_stats from existing user_actions history before today:
+    python backfill_stats.py
+ Run it on the day after the bot started maintaining the rollup, so that whole day is rebuilt from user_actions
+"""
+import action_log
+
+if __name__ == '__main__':
+    print(f'user_daily_stats rows written: {action_log.backfill_rollup()}')
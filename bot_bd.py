@@ -1,25 +1,60 @@
 import os
 import sys
-import requests
+import csv
+import io
 import telegram
 import config
-import psycopg2
+import db
+import http_client
 import ast
 import html
 import json
 import logging
+import re
+import time
 import traceback
-from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, ConversationHandler
-from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
+from queue import Queue
+from telegram.ext import Updater, CommandHandler, MessageHandler, Filters, ConversationHandler, \
+    CallbackQueryHandler, Dispatcher, JobQueue
+from telegram.utils.request import Request
+from functools import partial, wraps
 from random import choice, shuffle
 from threading import Thread
 # from datetime import time
-from bs4 import BeautifulSoup
 from google_trans_new import google_translator
+import translation_cache
+import lemmas
+import ru_lemmas
+import lexicon
+import vocab_cache
+import action_log
+import srs
+import providers
+import singleflight
+import queries
+import html_extract
+import migrate
+import chat_workers
+from psycopg2.extras import execute_values
 PORT = int(os.environ.get('PORT', '5000'))
 PLAY = range(1)  # var for ConversationHandler
 
 logger = logging.getLogger(__name__)
+# Threads for concurrent calls to translation providers
+providers_pool = ThreadPoolExecutor(max_workers=config.PROVIDER_WORKERS, thread_name_prefix='provider')
+# One translator for all handlers, it keeps connections to translate.google open between words
+translator = google_translator(timeout=config.PROVIDER_DEADLINES['google'],
+                               session=http_client.make_session(config.HTTP_POOL_SIZE, config.HTTP_RETRIES))
+
+
+class OrderedDispatcher(Dispatcher):
+    """ Dispatcher that hands updates to chat_workers: in order within a chat, in parallel between chats """
+
+    def process_update(self, update):
+        chat = update.effective_chat if isinstance(update, telegram.Update) else None
+        key = chat.id if chat is not None else id(update)
+        chat_workers.submit(key, super().process_update, update)
 
 
 def send_typing_action(func):
@@ -63,12 +98,15 @@ def error_handler(update, context):
 def stop_and_restart(updater):
     """Gracefully stop the Updater and replace the current process with a new one"""
     updater.stop()
+    chat_workers.shutdown()
+    action_log.flush()
+    db.close_all()
     os.execl(sys.executable, sys.executable, *sys.argv)
 
 
-def restart(update, context):
+def restart(update, context, updater):
     update.message.reply_text('Bot is restarting...')
-    Thread(target=stop_and_restart).start()
+    Thread(target=stop_and_restart, args=(updater,)).start()
 
 
 def bad_command(update, context) -> None:
@@ -76,95 +114,144 @@ def bad_command(update, context) -> None:
     context.bot.wrong_method_name()
 
 
-# Helper function that simplifies sql queries
-def send_query(sql_query: str, var=None):
-    record = None
-    conn = psycopg2.connect(config.DATABASE_URL)
-    cursor = conn.cursor()
-    cursor.execute(sql_query, var)
-    if sql_query.strip().lower()[:6] == 'select':
-        record = cursor.fetchall()
-    cursor.close()
-    conn.commit()
-    conn.close()
-    return record
+# uids already in users table, warmed at startup so every user is registered once per process
+known_users = set()
+
+
+def load_known_users():
+    known_users.update(str(row[0]) for row in queries.run(queries.KNOWN_USERS))
 
 
 def log_user(uid, update):
-    send_query(f"""insert into users select '{uid}',
-                    '{update.message.chat.first_name}',
-                    '{update.message.chat.last_name}', 
-                    '{update.message.chat.username}'
-                    where not exists (select uid from users where uid = '{uid}'); """)
+    if uid in known_users:
+        return
+    queries.run(queries.LOG_USER,
+                uid, update.message.chat.first_name, update.message.chat.last_name, update.message.chat.username)
+    known_users.add(uid)
 
 
 def conjugate(input_):
-    """ Try to get verb conjugation via reverso.net """
+    """ Get infinitive from local lemma index, try reverso.net conjugation only for words the index doesn't know """
     word_seq = input_.split()  # needed for phrasal verbs
+    lemma = lemmas.lookup(word_seq[0])  # conjugate only first word
+    if lemma is not None:
+        word_seq[0] = lemma
+        return ' '.join(word_seq)
     try:
-        response = requests.get(
-            f'https://conjugator.reverso.net/conjugation-english-verb-{word_seq[0]}.html',  # conjugate only first word
-            headers={'User-Agent': 'Mozilla/5.0'})
-        soup = BeautifulSoup(response.content, 'html.parser')
-        for w in soup.find_all("a", "targetted-word-transl", tooltip="Existing infinitive"):
-            word_seq[0] = w.text.strip()
+        lemma = providers.call('conjugator', reverso_infinitive, word_seq[0])
+        lemmas.remember(word_seq[0], lemma)
+        word_seq[0] = lemma or word_seq[0]
     except Exception:
         pass
     return ' '.join(word_seq)
 
 
-# Translation functions: get BeautifulSoup with parse func, extract translation and examples from it with others
+def reverso_infinitive(word: str):
+    """ Infinitive from conjugator.reverso.net, None if the word has no infinitive """
+    with http_client.session.get(f'https://conjugator.reverso.net/conjugation-english-verb-{word}.html',
+                                 timeout=config.PROVIDER_DEADLINES['conjugator'], stream=True) as response:
+        if response.status_code == 404:  # conjugator has no page for words that aren't verbs
+            return None
+        response.raise_for_status()
+        return html_extract.infinitive(response)
+
+
+# Translation functions: fetch provider pages and extract only the needed elements from them
+def reverso_translations(word: str, limit: int = None) -> list:
+    """ Translations of the word from reverso.net, most popular first. With limit the page is read only that far """
+    with http_client.session.get(f'https://context.reverso.net/translation/english-russian/{word}',
+                                 timeout=config.PROVIDER_DEADLINES['reverso'], stream=True) as response:
+        if response.status_code == 404:  # unknown word
+            return []
+        response.raise_for_status()
+        return html_extract.translations(response, limit)
+
+
+def google_translation(word: str):
+    """
+    Translation via google_translator for en-ru pair, None for other languages. Target language is picked by
+    alphabet, so detection and translation fit in one request
+    """
+    lang_tgt = 'en' if re.search(r'[\u0400-\u04FF]', word) else 'ru'
+    result = providers.call('google', translator.translate_detect, word, lang_tgt)
+    if result and {result[1], lang_tgt} == {'en', 'ru'}:
+        return result[0].strip()  # google ends every sentence with a space
+    return None
+
+
+# returned by provider_result when provider failed or was too slow, None and [] are answers "nothing found"
+NO_ANSWER = object()
+
+
+def provider_result(future, provider: str, started: float):
+    """ Wait for provider call until its deadline. Returns NO_ANSWER if provider failed or is too slow """
+    try:
+        return future.result(timeout=max(0.0, started + config.PROVIDER_DEADLINES[provider] - time.monotonic()))
+    except (FutureTimeoutError, TimeoutError, providers.ProviderUnavailable) as e:
+        logger.warning(f'{provider} gave no answer: {e or "deadline passed"}')
+    except Exception:
+        logger.warning(f'{provider} lookup failed', exc_info=True)
+    return NO_ANSWER
+
+
+def lookup_translation(word: str) -> str:
+    """
+    Translate word in en-ru language pair. reverso.net and google translate are queried at the same time, reverso
+    result wins because google_translate is less accurate but translates wider range of words, so google is used
+    only when reverso found nothing. Last step - russian word normalization with the local morphology dictionary.
+    Raises LookupError if every provider answered without a translation and ProviderUnavailable if some of them
+    failed or missed the deadline, so the word may be found later
+    :param word: word in English or Russian
+    :return: most popular [normalized] word translation
+    """
+    started = time.monotonic()
+    reverso = providers_pool.submit(providers.call, 'reverso', reverso_translations, word, 1)
+    google = providers_pool.submit(google_translation, word)
+
+    _list = provider_result(reverso, 'reverso', started)
+    failed = _list is NO_ANSWER
+    _list = [] if failed else _list
+    if _list:
+        google.cancel()
+    else:
+        google_result = provider_result(google, 'google', started)
+        failed = failed or google_result is NO_ANSWER
+        if google_result and google_result is not NO_ANSWER:
+            _list.append(google_result)
+    if not _list and failed:
+        raise providers.ProviderUnavailable(f'Not every provider answered for {word!r}')
+    if not _list:
+        raise LookupError(f'No translation found for {word!r}')
+
+    # Get normalized word form, no network involved
+    return ru_lemmas.normalize(_list[0])
+
+
 def translation(word: str) -> str:
     """
-    Translate word in en-ru language pair. First step - function tries to translate word with reverso.net and appends
-    all translations to a list. Second step - translate word with google translate and append it to list. Using these
-    steps because google_translate is less accurate but translates wider range of words. Third step - russian word
-    normalization via request to opencorpora.org
+    Translation from the bundled lexicon for common words, cached lookup_translation for the rest.
+    Words that weren't found are remembered too and raise LookupError until they expire,
+    ProviderUnavailable from a provider outage isn't remembered
     :param word: word in English or Russian
     :return: most popular [normalized] word translation
     """
-    _list = []  # list with word translations
-    # Try to get translation via reverso.net
-    response = requests.get(
-        f'https://context.reverso.net/translation/english-russian/{word}',
-        headers={'User-Agent': 'Mozilla/5.0'})
-    soup = BeautifulSoup(response.content, 'html.parser')
-    try:
-        for w in soup.find_all("a", {"class": "translation"}):
-            trans = w.text.strip()
-            _list.append(trans)
-        _list.pop(0)  # popping word 'Translation'
-    except Exception:
-        pass
-    try:
-        for w in soup.find_all("div", {"class": "translation"}):
-            trans = w.text.strip()
-            _list.append(trans)
-    except Exception:
-        pass
+    direction = 'ru-en' if re.search(r'[\u0400-\u04FF]', word) else 'en-ru'
+    result = lexicon.lookup(word, direction)
+    if result is not None:
+        return result
 
-    # Append translation via google_translator in case of exception on previous step
-    translator = google_translator()
-    language = translator.detect(word)
-    if language[0] == 'en':
-        _list.append(translator.translate(word, lang_src=language[0], lang_tgt='ru'))
-    elif language[0] == 'ru':
-        _list.append(translator.translate(word, lang_src=language[0], lang_tgt='en'))
+    result = translation_cache.get(word, direction)
+    if result is None:
+        raise LookupError(f'No translation found for {word!r}')
+    if result is not translation_cache.MISS:
+        return result
 
-    # Try to get normalized word form and ignore the move if Exception occurs
-    result = _list[0]
     try:
-        _list = []
-        response = requests.get(
-            f'http://opencorpora.org/dict.php?search_form={result}&act=lemmata',
-            headers={'User-Agent': 'Mozilla/5.0'})
-        for w in BeautifulSoup(response.content, 'html.parser').find_all("a", href=True):
-            word = w.text.strip()
-            _list.append(word)
-        result = _list[14].split()[1]
-    except Exception:
-        pass
-
+        result = lookup_translation(word)
+    except LookupError:
+        translation_cache.put(word, direction, None)
+        raise
+    translation_cache.put(word, direction, result)
     return result
 
 
@@ -174,16 +261,49 @@ def examples(word: str) -> list:
     :param word: word in English
     :return: list with examples
     """
+    return providers.call('twinword', twinword_examples, word)
+
+
+def twinword_examples(word: str) -> list:
+    """ Examples from Twinword API, empty list if it doesn't know the word """
     url = "https://twinword-word-graph-dictionary.p.rapidapi.com/example/"
     querystring = {'entry': word}
 
-    response = requests.request("GET", url, headers=config.HEADERS, params=querystring)
-    # Create dictionary from the response result
+    response = http_client.session.get(url, headers=config.HEADERS, params=querystring,
+                                       timeout=config.PROVIDER_DEADLINES['twinword'])
+    response.raise_for_status()
+    # Create dictionary from the response result, unknown words come with result_code and no 'example' key
     response_dict = ast.literal_eval(response.text)
-    examples_list = response_dict['example']
+    examples_list = response_dict.get('example') or []
     return examples_list
 
 
+def lookup_word(word: str):
+    """
+    Translation and examples of a word missing from words. Users adding the same word at the same time
+    share one lookup, so providers are called once per word
+    :param word: infinitive in English
+    :return: (meaning, examples list), examples list is empty if Twinword has none
+    """
+    return singleflight.do(('lookup_word', word), _lookup_word, word)
+
+
+def _lookup_word(word: str):
+    return translation(word).lower(), examples(word)
+
+
+def insert_common_word(word: str, meaning: str, examples_list: list):
+    """
+    Insert word into words unless another process did it first.
+    :return: (meaning, examples) that ended up in words
+    """
+    record = queries.run(queries.INSERT_COMMON_WORD, word, meaning, examples_list)
+    if not record:
+        return vocab_cache.common_word(word)
+    vocab_cache.put_common_word(word, meaning, examples_list)
+    return meaning, tuple(examples_list)
+
+
 # Start message
 def start(update, context):
     uid = str(update.message.chat_id)
@@ -193,7 +313,7 @@ def start(update, context):
                              text="Привет, я Voc! Я могу помочь тебе развить свой словарь.\n"
                                   "Команда /help покажет, что я могу")
     # Log action into user_actions table
-    send_query(f"insert into user_actions (uid, action) values ('{uid}', 'start')")
+    action_log.record(uid, 'start')
     log_user(uid, update)  # Log user into users table
 
 
@@ -224,13 +344,15 @@ def help_me(update, context):
                                   "Удалить слово ты можешь командой /delete [слово] .\n"
                                   "А изменить значение можно командой /edit [слово][-][новое значение].\n"
                                   "Твой личный словарь откроется по команде /voc.\n"
+                                  "Чтобы добавить сразу много слов, отправь команду /import и пришли .txt или .csv "
+                                  "файл со словами.\n"
                                   "Если отправишь /stats , я покажу небольшую статистику освоения словаря\n\n"
                                   "Активное изучение начинается с команды /play. Я пришлю тебе слово и "
                                   "пример его употребления. А тебе нужно будет выбрать правильный вариант из списка\n\n"
                                   "Оставить обратную связь для мешка, который меня сделал, можно командой /m \U0001F60B"
                              )
     # Log action into user_actions table
-    send_query(f"insert into user_actions (uid, action) values ('{uid}', 'help')")
+    action_log.record(uid, 'help')
     log_user(uid, update)  # Log user into users table
 
 
@@ -244,55 +366,51 @@ def add_word(update, context):
     var_text = 'New word'  # Variational phrase depending if word is already added
     uid = str(update.message.chat_id)
     word = update.message.text.lower().split(' ')[0]  # Use only first word in case of phrase
-    word = conjugate(word)  # conjugation of verbs
 
-    record = send_query(f"select count(word) from words where word = '{word}'")
-    if record[0][0] == 0:
+    common_word = vocab_cache.common_word(word)
+    if common_word is None:  # words stores infinitives, so known words skip conjugation
+        word = conjugate(word)  # conjugation of verbs
+        common_word = vocab_cache.common_word(word)
+    if common_word is None:
         try:
-            translation_result = translation(word)
-            translation_result = translation_result.lower()
-            examples_list = examples(word)
+            translation_result, examples_list = lookup_word(word)
             if len(examples_list) != 0:
-                examples_list = (examples_list,)
-                sql_query = f"insert into words (word, meaning, examples) values (%s, %s, %s)"
-                send_query(sql_query, (word, translation_result, examples_list))
+                common_word = insert_common_word(word, translation_result, examples_list)
             else:
                 # Log action into user_actions table
-                send_query(f"insert into user_actions (uid, action) values ('{uid}', 'add_word_fail_example')")
+                action_log.record(uid, 'add_word_fail_example')
                 context.bot.send_message(chat_id=update.effective_chat.id,
                                          text=f"Не получилось найти пример использования этого слова \U0001F914")
+                return
         except Exception:
             # Log action into user_actions table
-            send_query(f"insert into user_actions (uid, action) values ('{uid}', 'add_word_fail')")
+            action_log.record(uid, 'add_word_fail')
             context.bot.send_message(chat_id=update.effective_chat.id, text=f"Я не смог найти это слово \U0001F914")
             raise
 
     # Add word to user personal dict if it's not there. Else change output message
-    record = send_query(
-        f"select count(word), bool_or(is_deleted) from user_words where uid = '{uid}' and word = '{word}'; ")
-    if record[0][0] == 0:
-        send_query(f"insert into user_words (uid, word) values ('{uid}', '{word}')")
-    elif record[0][1] == 1:
-        send_query(f"update user_words set is_deleted = False where uid = '{uid}' and word = '{word}'")
-    elif record[0][1] == 0:
+    row = vocab_cache.row(uid, word)
+    if row is None:
+        record = queries.run(queries.ADD_USER_WORD, uid, word)
+        vocab_cache.put(uid, word, meaning=common_word[0], has_examples=bool(common_word[1]), due_at=record[0][0])
+    elif row.is_deleted:
+        record = queries.run(queries.ADD_USER_WORD, uid, word)
+        vocab_cache.put(uid, word, is_deleted=False, due_at=record[0][0])
+    else:
         var_text = 'Слово уже есть словаре'
 
     # Send message
-    record = send_query(f"""
-                        select is_edited, meaning, examples, edit
-                        from user_words uw left join words w on w.word = uw.word
-                        where uid = '{uid}' and w.word = '{word}';""")
-
-    real_meaning = record[0][1] if record[0][0] == 0 else record[0][3]
-    if record[0][2]:
-        string_ = f"Пример:\n{choice(record[0][2])}"
+    row = vocab_cache.row(uid, word)
+    real_meaning = row.meaning if row is not None and row.meaning is not None else common_word[0]
+    if common_word[1]:
+        string_ = f"Пример:\n{choice(common_word[1])}"
 
     else:
         string_ = ''
     context.bot.send_message(chat_id=update.effective_chat.id,
                              text=f"{var_text}:\n{word} - {real_meaning}\n\n" + string_)
     # Log action into user_actions table
-    send_query(f"insert into user_actions (uid, action) values ('{uid}', 'add_word')")
+    action_log.record(uid, 'add_word')
 
     log_user(uid, update)  # Log user into users table
 
@@ -306,17 +424,156 @@ def add_words_manually(update, context):
     message = ' '.join(context.args)
     word, meaning = message.split('-')
     word, meaning = word.strip(), meaning.strip()
-    record = send_query(f"select count(*) from user_words where word = '{word}'; ")
-    if record[0][0] == 1:
-        send_query(f"""update user_words set is_deleted = False, is_edited = True, edit = '{meaning}' 
-                        where uid = '{uid}' and word = '{word}'; """)
-    elif record[0][0] == 0:
-        send_query(f"""insert into user_words (uid, word, is_edited, edit) 
-                        values ('{uid}', '{word}', True, '{meaning}'); """)
+    record = queries.run(queries.ADD_MANUAL_WORD, uid, word, meaning)
+    if vocab_cache.row(uid, word) is not None:
+        vocab_cache.put(uid, word, meaning=meaning, is_deleted=False, due_at=record[0][0])
+    else:
+        common_word = vocab_cache.common_word(word)
+        vocab_cache.put(uid, word, meaning=meaning, has_examples=bool(common_word and common_word[1]),
+                        due_at=record[0][0])
     context.bot.send_message(chat_id=update.effective_chat.id,
                              text=f"Слово {word} добавлено")
     # Log action into user_actions table
-    send_query(f"insert into user_actions (uid, action) values ('{uid}', 'add_manual')")
+    action_log.record(uid, 'add_manual')
+
+
+# Bulk import of words from a text/csv file
+# words.word, words.meaning and user_words.word are varchar(30)
+WORD_MAX_LENGTH = 30
+
+
+def read_import_words(data: bytes):
+    """
+    First word of the first column of every line, lowercased and deduplicated.
+    :return: (words, rejected), rejected are tokens longer than WORD_MAX_LENGTH or with Cyrillic letters
+    """
+    words, rejected = [], []
+    for row in csv.reader(io.StringIO(data.decode('utf-8-sig', 'ignore'))):
+        if row and row[0].strip():
+            word = row[0].strip().lower().split(' ')[0]
+            if len(word) > WORD_MAX_LENGTH or re.search(r'[\u0400-\u04FF]', word):
+                rejected.append(word)
+            else:
+                words.append(word)
+    return list(dict.fromkeys(words)), list(dict.fromkeys(rejected))
+
+
+def enrich_word(word: str):
+    """
+    Import pipeline step for a word missing from words: conjugation, translation and examples.
+    :return: (infinitive, meaning, examples), meaning is None if infinitive is already in words;
+             None if not found or the infinitive or meaning is too long to be stored
+    """
+    word = conjugate(word)
+    if vocab_cache.common_word(word) is not None:
+        return word, None, None
+    if len(word) > WORD_MAX_LENGTH:
+        return None
+    meaning, examples_list = lookup_word(word)
+    if not examples_list or len(meaning) > WORD_MAX_LENGTH:
+        return None
+    return word, meaning, examples_list
+
+
+def import_intro(update, context):
+    context.bot.send_message(chat_id=update.effective_chat.id,
+                             text="Пришли мне .txt или .csv файл: по одному слову в строке "
+                                  "(для csv - в первой колонке). Я переведу их и добавлю в твой словарь")
+
+
+def import_rows(uid, words: list, report) -> tuple:
+    """
+    Words already in the common dictionary are taken as is, the rest go through enrich_word on a bounded pool,
+    and all rows are inserted at the end with two statements. report(done) is called as words are processed
+    :return: (added words, words that weren't found)
+    """
+    known = {row[0] for row in queries.run(queries.KNOWN_WORDS, words)}
+    added = [word for word in words if word in known]
+    new_words, failed = {}, []
+    progress = {'done': len(added), 'reported': time.monotonic()}
+
+    def collect(futures):
+        for future in futures:
+            try:
+                result = future.result()
+            except Exception:
+                logger.warning('Import of a word failed', exc_info=True)
+                result = None
+            if result is None:
+                failed.append(futures[future])
+            else:
+                added.append(result[0])
+                if result[1] is not None:
+                    new_words[result[0]] = result
+            progress['done'] += 1
+        if time.monotonic() - progress['reported'] >= config.IMPORT_PROGRESS_INTERVAL:
+            progress['reported'] = time.monotonic()
+            report(progress['done'])
+
+    # at most 2 words per worker are in flight, the file is read further only when a word is done
+    with ThreadPoolExecutor(max_workers=config.IMPORT_WORKERS, thread_name_prefix='import') as pool:
+        pending = {}
+        for word in words:
+            if word in known:
+                continue
+            if len(pending) >= 2 * config.IMPORT_WORKERS:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect({future: pending.pop(future) for future in done})
+            pending[pool.submit(enrich_word, word)] = word
+        wait(pending)
+        collect(pending)
+
+    added = list(dict.fromkeys(added))
+    with db.transaction() as cursor:
+        if new_words:
+            execute_values(cursor, "insert into words (word, meaning, examples) values %s on conflict (word) do nothing",
+                           list(new_words.values()))
+        if added:
+            execute_values(cursor, """insert into user_words (uid, word) values %s
+                                      on conflict (uid, word) do update set is_deleted = False""",
+                           [(uid, word) for word in added])
+    for word, meaning, examples_list in new_words.values():
+        vocab_cache.put_common_word(word, meaning, examples_list)
+    vocab_cache.invalidate(uid)  # reloaded with the imported words on next read
+    return added, failed
+
+
+def import_words(update, context):
+    """ Add every word of the uploaded file, progress is shown by editing one status message """
+    uid = str(update.message.chat_id)
+    chat_id = update.effective_chat.id
+    data = context.bot.get_file(update.message.document.file_id).download_as_bytearray()
+    words, rejected = read_import_words(bytes(data))
+    if not words:
+        context.bot.send_message(chat_id=chat_id, text='В файле не нашлось английских слов \U0001F914')
+        return
+    skipped = max(0, len(words) - config.IMPORT_MAX_WORDS)
+    words = words[:config.IMPORT_MAX_WORDS]
+    status = context.bot.send_message(chat_id=chat_id, text=f"Импорт: 0 из {len(words)}")
+
+    def report(done):
+        context.bot.edit_message_text(chat_id=chat_id, message_id=status.message_id,
+                                      text=f"Импорт: {done} из {len(words)}")
+
+    try:
+        added, failed = import_rows(uid, words, report)
+    except Exception:
+        context.bot.edit_message_text(chat_id=chat_id, message_id=status.message_id,
+                                      text="Импорт прервался, слова не добавлены \U0001F630 Попробуй ещё раз позже")
+        action_log.record(uid, 'import_fail')
+        raise
+
+    text = f"Импорт завершён: добавлено {len(added)} из {len(words)} слов"
+    if skipped:
+        text += f"\nФайл слишком длинный: за раз я добавляю до {config.IMPORT_MAX_WORDS} слов, " \
+                f"последние {skipped} пропущены. Пришли их отдельным файлом"
+    if rejected:
+        text += f"\nПропущено строк не с английским словом или длиннее {WORD_MAX_LENGTH} символов: {len(rejected)}"
+    if failed:
+        text += f"\nНе получилось найти: {', '.join(failed[:20])}" + (' ...' if len(failed) > 20 else '')
+    context.bot.edit_message_text(chat_id=chat_id, message_id=status.message_id, text=text)
+    action_log.record(uid, 'import')
+    log_user(uid, update)  # Log user into users table
 
 
 @send_typing_action
@@ -331,12 +588,12 @@ def translate_russian(update, context):
         context.bot.send_message(chat_id=update.effective_chat.id,
                                  text=f'Перевод:\n{word} - {translation_result}')
         # Log action into user_actions table
-        send_query(f"insert into user_actions (uid, action) values ('{uid}', 'translate_russian')")
+        action_log.record(uid, 'translate_russian')
     except Exception:
         context.bot.send_message(chat_id=update.effective_chat.id,
                                  text=f"Упс, проблемы \U0001F630")
         # Log action into user_actions table
-        send_query(f"insert into user_actions (uid, action) values ('{uid}', 'translate_russian_fail')")
+        action_log.record(uid, 'translate_russian_fail')
 
 
 # Delete word (word pair) sent after /delete
@@ -346,17 +603,18 @@ def delete_word(update, context):
     word = ' '.join(context.args)
 
     # Look if word is in user-words dict and is not deleted
-    record = send_query(f"select is_deleted from user_words where uid = '{uid}' and word = '{word}';")
-    if record and record[0][0] == 0:
-        send_query(f"update user_words set is_deleted = True where uid = '{uid}' and  word = '{word}'")
+    row = vocab_cache.row(uid, word)
+    if row is not None and not row.is_deleted:
+        queries.run(queries.DELETE_WORD, uid, word)
+        vocab_cache.put(uid, word, is_deleted=True)
         context.bot.send_message(chat_id=update.effective_chat.id,
                                  text=f"Слово *{word}* удалено", parse_mode=telegram.ParseMode.MARKDOWN)
         # Log action into user_actions table
-        send_query(f"insert into user_actions (uid, action) values ('{uid}', 'delete_word')")
+        action_log.record(uid, 'delete_word')
     else:
         context.bot.send_message(chat_id=update.effective_chat.id, text=f'Упс. Что-то пошло не так')
         # Log action into user_actions table
-        send_query(f"insert into user_actions (uid, action) values ('{uid}', 'delete_word_fail')")
+        action_log.record(uid, 'delete_word_fail')
 
 
 # Edit word
@@ -367,158 +625,194 @@ def edit(update, context):
     word, new_meaning = message.split('-')
     word, new_meaning = word.strip(), new_meaning.strip()
 
-    sql_query = f"""
-                select w.word, meaning, examples, edit, is_edited, is_deleted 
-                from user_words uw
-                join words w
-                    on w.word = uw.word
-                    and uw.uid = '{uid}';
-                """
-    record = send_query(sql_query)
-    if record[0][0]:
-        send_query(f"""update user_words set is_edited = True, edit = '{new_meaning}'
-                       where uid = '{uid}' and word = '{word}'""")
+    if vocab_cache.row(uid, word) is not None:
+        queries.run(queries.EDIT_WORD, uid, word, new_meaning)
+        vocab_cache.put(uid, word, meaning=new_meaning)
 
         context.bot.send_message(chat_id=update.effective_chat.id,
                                  text=f'Новое значение:\n\n'f'{word} - {new_meaning} ')
         # Log action into user_actions table
-        send_query(f"insert into user_actions (uid, action) values ('{uid}', 'edit')")
+        action_log.record(uid, 'edit')
     else:
         context.bot.send_message(chat_id=update.effective_chat.id, text=f"Пока я не храню такое слово")
         # Log action into user_actions table
-        send_query(f"insert into user_actions (uid, action) values ('{uid}', 'edit_fail')")
+        action_log.record(uid, 'edit_fail')
+
+
+# Prints vocabulary page by page, pages are switched with inline buttons
+def voc_page(uid, after=None, before=None):
+    """ Text and keyboard of the vocabulary page after/before the word, None if vocabulary is empty """
+    rows, total, has_prev, has_next = vocab_cache.page(uid, config.VOC_PAGE_SIZE, after=after, before=before)
+    if not rows:
+        return None, None
+    response = f"Сейчас в словаре {total} слов:\n\n" + '\n'.join(f"{row.word} - {row.meaning}" for row in rows)
+    buttons = []
+    if has_prev:
+        buttons.append(telegram.InlineKeyboardButton('\u2B05', callback_data=voc_cursor('prev', rows[0].word)))
+    if has_next:
+        buttons.append(telegram.InlineKeyboardButton('\u27A1', callback_data=voc_cursor('next', rows[-1].word)))
+    return response, telegram.InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+def voc_cursor(direction: str, word: str) -> str:
+    """ Callback data is limited to 64 bytes, longer words are cut, which only makes the page start a bit earlier """
+    data = f'voc:{direction}:{word}'
+    return data.encode('utf-8')[:64].decode('utf-8', 'ignore')
 
 
-# Prints whole vocabulary as message
 @send_typing_action
 def voc(update, context):
     uid = str(update.message.chat_id)
-    sql_query = f"""
-                select uw.word, meaning, examples, edit, is_edited 
-                from user_words uw
-                left join words w
-                    on w.word = uw.word
-                where uw.uid = '{uid}' and is_deleted = False
-                order by 1;
-                """
-    record = send_query(sql_query)
-    response = f"Сейчас в словаре {len(record)} слов:\n\n"
-    for i in range(len(record)):
-        if record[i][4] == 0:
-            response += record[i][0] + ' - ' + record[i][1] + '\n'
-        elif record[i][4] == 1:
-            response += record[i][0] + ' - ' + record[i][3] + '\n'
-    if not record:
+    response, keyboard = voc_page(uid)
+    if response is None:
         context.bot.send_message(chat_id=update.effective_chat.id,
                                  text='Словарик пока пуст. Пришли мне несколько слов \U0001F61C')
     else:
-        context.bot.send_message(chat_id=update.effective_chat.id, text=response)
+        context.bot.send_message(chat_id=update.effective_chat.id, text=response, reply_markup=keyboard)
     # Log action into user_actions table
-    send_query(f"insert into user_actions (uid, action) values ('{uid}', 'voc')")
+    action_log.record(uid, 'voc')
+
+
+def voc_navigate(update, context):
+    """ Inline button handler: replace the message with the next or previous page """
+    query = update.callback_query
+    uid = str(query.message.chat_id)
+    _, direction, word = query.data.split(':', 2)
+    if direction == 'next':
+        response, keyboard = voc_page(uid, after=word)
+    else:
+        response, keyboard = voc_page(uid, before=word)
+    query.answer()
+    if response is not None:
+        query.edit_message_text(text=response, reply_markup=keyboard)
 
 
 # Play functions that prints example - word and 3 possible translations
+def round_dummies(rows, main, exclude=None) -> list:
+    """ Playable rows with meanings different from the main word and from each other """
+    dummies = {}
+    for row in rows:
+        if vocab_cache.playable(row) and row.score < 5 and row.word not in (main.word, exclude) \
+                and row.meaning != main.meaning:
+            dummies.setdefault(row.meaning, row)
+    return list(dummies.values())
+
+
+def build_round(uid, exclude=None):
+    """
+    Take the most overdue non-deleted word and random dummies with other meanings from cached vocabulary.
+    :param exclude: word left out of the round, used for prefetch while this word is still being guessed
+    :return: {'main': VocabRow, 'words': quiz rows in answer order, 'example': str} or None if there are too few words
+    """
+    last_word = exclude or vocab_cache.last_word(uid)
+    main = vocab_cache.next_due(uid, skip={exclude, last_word})  # != last round word
+    if main is None:
+        return None
+    list_len = (vocab_cache.active_count(uid) - 1) // 6  # len of list with dummies
+    list_len = 2 if list_len <= 2 else 8 if list_len >= 8 else list_len
+    # Dummies with meaning different from main word meaning and from each other
+    dummies = round_dummies(vocab_cache.sample(uid, 3 * list_len + config.ROUND_SAMPLE_EXTRA), main, exclude)
+    if len(dummies) < 2:  # random draws missed, most active words may be without examples
+        rows = vocab_cache.active_rows(uid)
+        shuffle(rows)
+        dummies = round_dummies(rows, main, exclude)
+    if len(dummies) < 2:
+        return None
+
+    game_words = dummies[:list_len] + [main]  # list with quiz words
+    shuffle(game_words)
+    return {'main': main, 'words': game_words, 'example': choice(vocab_cache.common_word(main.word)[1])}
+
+
+# uid -> future with the next round, built while the user answers the current one
+prefetched_rounds = {}
+prefetch_pool = ThreadPoolExecutor(max_workers=config.PREFETCH_WORKERS, thread_name_prefix='prefetch')
+
+
+def take_prefetched_round(uid):
+    """ Prefetched round if it's still valid: none of its words were edited, deleted or scored since """
+    future = prefetched_rounds.pop(uid, None)
+    if future is None:
+        return None
+    try:
+        game = future.result(timeout=config.PREFETCH_WAIT)
+    except Exception:
+        logger.warning('Round prefetch failed', exc_info=True)
+        return None
+    if game is None or any(vocab_cache.row(uid, row.word) != row for row in game['words']):
+        return None
+    return game
+
+
 @send_typing_action
 def play_game(update, context):
-    """Main game function that takes random non-deleted word and create bla-lba-lba"""
+    """
+    Main game function that sends round prefetched during the previous answer, or builds it right away.
+    The next round is prefetched as soon as this one is sent
+    """
     uid = str(update.message.chat_id)
-    record = send_query(f"""select uw.word from user_words uw join words w on w.word = uw.word
-                            where uid = '{uid}' and is_deleted = False and translation_score <= 5;""")
-
-    if len(record) < 3:
+    game = take_prefetched_round(uid) or build_round(uid)
+    if game is None:
         context.bot.send_message(chat_id=update.effective_chat.id,
                                  text='Чтобы сохранилась интрига, в словаре должно быть 3 слова с разными значениями')
-    elif len(record) >= 3:  # Больше 3 слов и прошлое слово отличается от нового
-        user_words = [record[i][0] for i in range(len(record))]
-        main_word = choice(user_words)
-        record = send_query(f"select max(word) from games where uid = '{uid}';")
-        while record[0][0] == main_word:    # pick word until != last round word
-            main_word = choice(user_words)
-
-        # Delete from word-list words with same meaning as main word
-        record = send_query(f"""select uw.word 
-                                from user_words uw join words w on w.word = uw.word
-                                where uid = '{uid}' 
-                                    and is_deleted = False 
-                                    and translation_score < 5
-                                    and uw.word != '{main_word}'
-                                    and w.meaning != (select meaning from words where word = '{main_word}') 
-                                    ;""")
-        user_words = [record[i][0] for i in range(len(record))]
-        if len(user_words) < 2:
-            context.bot.send_message(chat_id=update.effective_chat.id,
-                                     text='Чтобы сохранилась интрига, '
-                                          'в словаре должно быть 3 слова с разными значениями')
-            
-        game_words = [main_word]  # list with quiz words
-        list_len = len(user_words) // 6  # len of list with dummies
-        list_len = 2 if list_len <= 2 else 8 if list_len >= 8 else list_len
-        for _ in range(list_len):
-            dummy = choice(user_words)
-            game_words.append(dummy)
-            user_words.remove(dummy)
-
-        shuffle(game_words)
-        example = ''
-        meaning = []
-        for i in range(len(game_words)):
-            record = send_query(f"""select uw.word, edit, is_edited, meaning, examples, translation_score
-                                                from user_words uw join words w on w.word = uw.word
-                                                where uid = '{uid}' and is_deleted=False and uw.word='{game_words[i]}';
-            """)
-            real_meaning = record[0][3] if record[0][2] == 0 else record[0][1]
-            meaning.append(real_meaning)
-            if record[0][0] == main_word:
-                example = choice(record[0][4])
-                send_query(f"""update games 
-                                    set word = '{main_word}',
-                                    answer_var = {i + 1}, 
-                                    translation_score = {record[0][5]},
-                                    meaning = '{real_meaning}'
-                                where uid = '{uid}'; """)
-        reply_string = '\n'.join([f"{i+1}. {meaning[i]}" for i in range(len(meaning))])
-        context.bot.send_message(chat_id=update.effective_chat.id,
-                                 text=f"{example}\n\nЗначение слова *{main_word}*:\n" + reply_string +
-                                      "\n\nВведи номер правильного ответа или 0 для *выхода*",
-                                 parse_mode=telegram.ParseMode.MARKDOWN)
+        return
+
+    main, game_words = game['main'], game['words']
+    reply_string = '\n'.join([f"{i+1}. {game_words[i].meaning}" for i in range(len(game_words))])
+    context.bot.send_message(chat_id=update.effective_chat.id,
+                             text=f"{game['example']}\n\nЗначение слова *{main.word}*:\n" + reply_string +
+                                  "\n\nВведи номер правильного ответа или 0 для *выхода*",
+                             parse_mode=telegram.ParseMode.MARKDOWN)
+    queries.run(queries.SET_GAME, uid, main.word, game_words.index(main) + 1, main.score, main.meaning)
+    vocab_cache.set_last_word(uid, main.word)
+    prefetched_rounds[uid] = prefetch_pool.submit(build_round, uid, main.word)
 
 
 @send_typing_action
 def play_intro(update, context):
     uid = str(update.message.chat_id)
-    send_query(f"""insert into games select '{uid}', '', 0, 0, ''
-                    where not exists (select uid from games where uid = '{uid}'); """)
+    queries.run(queries.INIT_GAME, uid)
     context.bot.send_message(chat_id=update.effective_chat.id,
                              text="Сейчас я отправлю слово. Попробуй выбрать правильный вариант ответа\n"
                                   "После 5 правильных ответов я помечу, что слово изучено и уберу его из словарика",
                              parse_mode=telegram.ParseMode.MARKDOWN)
     play_game(update, context)
-    send_query(f"insert into user_actions (uid, action) values ('{uid}', 'play')")
+    action_log.record(uid, 'play')
     return PLAY
 
 
+def score_word(uid, word, score, correct, mastered=False):
+    """ Save new score of the word and schedule its next review with SM-2. Mastered words are marked as deleted """
+    row = vocab_cache.row(uid, word) or vocab_cache.VocabRow(word, None, score, False, False)
+    interval, ease, repetitions = srs.review(row.interval, row.ease, row.repetitions, correct)
+    record = queries.run(queries.SCORE_WORD, uid, word, score, mastered, interval, ease, repetitions)
+    fields = dict(score=score, interval=interval, ease=ease, repetitions=repetitions)
+    if record:
+        fields['due_at'] = record[0][0]
+    if mastered:
+        fields['is_deleted'] = True
+    vocab_cache.put(uid, word, **fields)
+
+
 @send_typing_action
 def play(update, context):
     uid = str(update.message.chat_id)
     word = update.message.text
-    record = send_query(f"""select word, answer_var, translation_score, meaning
-                            from games where uid = '{uid}'; """)
+    record = queries.run(queries.GAME, uid)
     if word == str(record[0][1]):
         context.bot.send_message(chat_id=update.effective_chat.id,
                                  text=f"Отлично! \U0001F64C\n\nСчет *{record[0][0]}*: {record[0][2] + 1}",
                                  parse_mode=telegram.ParseMode.MARKDOWN)
-        send_query(f"insert into user_actions (uid, action) values ('{uid}', 'win')")
+        action_log.record(uid, 'win')
         # If it's 5th guess for the word mark word as deleted else add 1 score point
         if record[0][2] == 4:
-            send_query(f"""update user_words set is_deleted=True, translation_score = {record[0][2] + 1}
-                            where uid = '{uid}' and word = '{record[0][0]}';""")
+            score_word(uid, record[0][0], record[0][2] + 1, correct=True, mastered=True)
             context.bot.send_message(chat_id=update.effective_chat.id,
                                      text=f"Так держать! Слово *{record[0][0]}* изучено!",
                                      parse_mode=telegram.ParseMode.MARKDOWN)
-            send_query(f"insert into user_actions (uid, action) values ('{uid}', 'translation_mastered')")
+            action_log.record(uid, 'translation_mastered')
         else:
-            send_query(f"""update user_words set translation_score = {record[0][2] + 1}
-                            where uid = '{uid}' and word = '{record[0][0]}' ;""")
+            score_word(uid, record[0][0], record[0][2] + 1, correct=True)
 
     elif word != str(record[0][1]):
         score = 0 if record[0][2] == 0 else record[0][2] - 1
@@ -526,16 +820,15 @@ def play(update, context):
                                  text=f"Это ошибка \U0001F609\nЗначение слова {record[0][0]} - {record[0][3]} "
                                       f"\n\nСчет слова *{record[0][0]}*: {score}",
                                  parse_mode=telegram.ParseMode.MARKDOWN)
-        send_query(f"insert into user_actions (uid, action) values ('{uid}', 'lose')")
-        if record[0][2] > 0:
-            send_query(f"""update user_words set translation_score = {record[0][2] - 1}
-                                        where uid = '{uid}' and word = '{record[0][0]}' ;""")
+        action_log.record(uid, 'lose')
+        score_word(uid, record[0][0], score, correct=False)
 
     play_game(update, context)
     return PLAY
 
 
 def cancel(update, context):
+    prefetched_rounds.pop(str(update.message.chat_id), None)
     context.bot.send_message(chat_id=update.effective_chat.id, text=f"Приходи играть ещё! \U0001F64B")
     return ConversationHandler.END
 
@@ -544,22 +837,22 @@ def cancel(update, context):
 @send_typing_action
 def user_statistics(update, context):
     uid = str(update.message.chat_id)
-    record = send_query(f"""select  count(case when is_deleted = False then word end), 
-                                    count(case when translation_score = 5 then word end)
-                            from user_words where uid = '{uid}'; """)
-    reply = f"Из *{record[0][0] + record[0][1]}* добавленных слов успешно изучено *{record[0][1]}*.\n\n"
-    record = send_query(f"""select count(case when action in ('win', 'lose') then 1 end),
-                                    count(case when action = 'win' then 1 end),
-                                    count(case when action = 'translation_mastered' then 1 end)
-                            from user_actions where uid = '{uid}' and dttm >= now() - interval '7 days'
-                                    ;""")
-    reply += f"Удачных попыток за последнюю неделю: {record[0][1]}.\nВсего попыток: {record[0][0]}. " \
-             f"\nИзучено слов: {record[0][2]}.\n\nПрекрасная работа, не останавливайся \U0001F44F"
+    rows = vocab_cache.rows(uid)
+    active = sum(1 for row in rows if not row.is_deleted)
+    mastered = sum(1 for row in rows if row.score == 5)
+    reply = f"Из *{active + mastered}* добавленных слов успешно изучено *{mastered}*.\n\n"
+    record = queries.run(queries.WEEKLY_STATS, uid)
+    buffered = action_log.unflushed(uid)  # actions of the last seconds that aren't in the rollup yet
+    wins = record[0][1] + buffered.get('win', 0)
+    attempts = record[0][0] + buffered.get('win', 0) + buffered.get('lose', 0)
+    weekly_mastered = record[0][2] + buffered.get('translation_mastered', 0)
+    reply += f"Удачных попыток за последнюю неделю: {wins}.\nВсего попыток: {attempts}. " \
+             f"\nИзучено слов: {weekly_mastered}.\n\nПрекрасная работа, не останавливайся \U0001F44F"
 
     context.bot.send_message(chat_id=update.effective_chat.id,
                              text=reply,
                              parse_mode=telegram.ParseMode.MARKDOWN)
-    send_query(f"insert into user_actions (uid, action) values ('{uid}', 'stats')")
+    action_log.record(uid, 'stats')
 
 
 # Reminder function
@@ -572,6 +865,18 @@ def user_statistics(update, context):
 #         send_query(f"insert into user_actions (uid, action) values ('{record[i][0]}', 'reminder')")
 
 
+def health(update, context):
+    """ Worker pool saturation, queue wait and buffer metrics for the owner """
+    metrics = {'handlers': chat_workers.stats(), 'action_log': action_log.stats(),
+               'translation_cache': translation_cache.stats(), 'singleflight': singleflight.stats()}
+    metrics.update(providers.stats())
+    blocks = []
+    for name, values in metrics.items():
+        lines = [f"{key}: {round(value, 3) if isinstance(value, float) else value}" for key, value in values.items()]
+        blocks.append(f"{name}:\n" + '\n'.join(lines))
+    update.message.reply_text('\n\n'.join(blocks))
+
+
 def message_owner(update, context):
     uid = str(update.message.chat_id)
     message = ' '.join(context.args)
@@ -580,18 +885,36 @@ def message_owner(update, context):
 
 def main():
     # Init
-    updater = Updater(token=config.TOKEN, use_context=True)
-    dispatcher = updater.dispatcher
+    # upserts rely on unique keys from migrations, without them every insert of a new user or word fails
+    pending = migrate.pending_versions()
+    if pending:
+        sys.exit(f'Pending migrations {pending}, run "python migrate.py apply" first')
+    ru_lemmas.load()
+    load_known_users()
+    # a connection for every thread that can call Bot API at once: handler workers, run_async workers
+    # and 4 more that Updater reserves for the dispatcher, updater, job queue and main threads
+    request = Request(con_pool_size=config.HANDLER_WORKERS + config.ASYNC_WORKERS + 4)
+    dispatcher = OrderedDispatcher(telegram.Bot(config.TOKEN, request=request), Queue(), workers=config.ASYNC_WORKERS,
+                                   job_queue=JobQueue(), use_context=True)
+    dispatcher.job_queue.set_dispatcher(dispatcher)
+    updater = Updater(dispatcher=dispatcher, workers=None)  # workers come from the dispatcher
 
     # Add slash commands handlers
     dispatcher.add_handler(CommandHandler('delete', delete_word))
     dispatcher.add_handler(CommandHandler('edit', edit))
     dispatcher.add_handler(CommandHandler('voc', voc))
+    dispatcher.add_handler(CallbackQueryHandler(voc_navigate, pattern=r'^voc:'))
     dispatcher.add_handler(CommandHandler('start', start))
     dispatcher.add_handler(CommandHandler('help', help_me))
     dispatcher.add_handler(CommandHandler('stats', user_statistics))
     dispatcher.add_handler(CommandHandler('m', message_owner))
     dispatcher.add_handler(CommandHandler('add', add_words_manually))
+    dispatcher.add_handler(CommandHandler('import', import_intro))
+    # Import runs for minutes, so it doesn't block other updates
+    # csv from Excel/Windows comes as application/vnd.ms-excel or application/csv, so extensions are checked too
+    import_filter = Filters.document.category('text/') | Filters.document.file_extension('csv') | \
+        Filters.document.file_extension('txt')
+    dispatcher.add_handler(MessageHandler(import_filter, import_words, run_async=True))
 
     # Add add_word functionality to bot
     add_word_handler = MessageHandler(Filters.text & (~Filters.command) & Filters.regex(r'[^\u0400-\u04FF]') &
@@ -617,7 +940,9 @@ def main():
     # j = updater.job_queue
     # j.run_daily(reminder, time=time(15, 10, 0))
 
-    dispatcher.add_handler(CommandHandler('r', restart, filters=Filters.user(username='@ima_qt')))
+    dispatcher.add_handler(CommandHandler('r', partial(restart, updater=updater),
+                                          filters=Filters.user(username='@ima_qt')))
+    dispatcher.add_handler(CommandHandler('health', health, filters=Filters.user(username='@ima_qt')))
 
     # test command for error handler and himself
     dispatcher.add_handler(CommandHandler('bad_command', bad_command, filters=Filters.user(username='@ima_qt')))
@@ -632,6 +957,8 @@ def main():
 
     # updater.start_polling()
     updater.idle()
+    chat_workers.shutdown()
+    action_log.flush()  # write events left in the buffer before exit
 
 
 if __name__ == '__main__':
@@ -0,0 +1,49 @@
+"""
+ Build read-only en<->ru lexicon index (SQLite) from a tab separated word list:
+    python build_lexicon.py [source.tsv] [lexicon.sqlite]
+"""
+import os
+import sqlite3
+import sys
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+SOURCE_PATH = os.path.join(DATA_DIR, 'en_ru_lexicon.tsv')
+INDEX_PATH = os.path.join(DATA_DIR, 'en_ru_lexicon.sqlite')
+
+
+def read_pairs(source_path):
+    with open(source_path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip() or line.startswith('#'):
+                continue
+            english, russian = line.rstrip('\n').split('\t')
+            yield english.strip().lower(), russian.strip().lower()
+
+
+def build(source_path=SOURCE_PATH, index_path=INDEX_PATH):
+    """ Write index to a temporary file and move it in place, so readers never see a half-built index """
+    tmp_path = index_path + '.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    conn.execute("""create table lexicon
+                    (
+                    word text,
+                    direction text,
+                    translation text,
+                    primary key (word, direction)
+                    ) without rowid;""")
+    # first translation in the list wins in both directions
+    for english, russian in read_pairs(source_path):
+        conn.execute("insert or ignore into lexicon values (?, 'en-ru', ?)", (english, russian))
+        conn.execute("insert or ignore into lexicon values (?, 'ru-en', ?)", (russian, english))
+    conn.commit()
+    count = conn.execute("select count(*) from lexicon").fetchone()[0]
+    conn.close()
+    os.replace(tmp_path, index_path)
+    return count
+
+
+if __name__ == '__main__':
+    count = build(*sys.argv[1:3])
+    print(f'Lexicon index built: {count} entries')
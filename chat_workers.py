@@ -0,0 +1,86 @@
+"""
+ Worker pool for updates that keeps order within a chat.
+ Every chat has its own FIFO queue and at most one of its updates runs at a time, so a /play answer is handled
+ only after the round it answers. Different chats run in parallel on a shared pool of threads.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_chats = {}  # chat key -> deque of (enqueued_at, func, args) waiting behind the running update
+_lock = threading.Lock()
+_metrics = {'submitted': 0, 'done': 0, 'busy': 0, 'queued': 0, 'max_busy': 0,
+            'last_wait_seconds': 0.0, 'max_wait_seconds': 0.0, 'total_wait_seconds': 0.0}
+
+
+def _executor():
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=config.HANDLER_WORKERS, thread_name_prefix='handler')
+    return _pool
+
+
+def submit(key, func, *args):
+    """ Run func(*args) after every earlier call with the same key has finished """
+    task = (time.monotonic(), func, args)
+    with _lock:
+        _metrics['submitted'] += 1
+        _metrics['queued'] += 1
+        waiting = _chats.get(key)
+        if waiting is not None:  # chat is busy, the running update picks this one up when it's done
+            waiting.append(task)
+            return
+        _chats[key] = deque()
+    _executor().submit(_run, key, task)
+
+
+def _run(key, task):
+    while task is not None:
+        enqueued_at, func, args = task
+        wait = time.monotonic() - enqueued_at
+        with _lock:
+            _metrics['queued'] -= 1
+            _metrics['busy'] += 1
+            _metrics['max_busy'] = max(_metrics['max_busy'], _metrics['busy'])
+            _metrics['last_wait_seconds'] = wait
+            _metrics['max_wait_seconds'] = max(_metrics['max_wait_seconds'], wait)
+            _metrics['total_wait_seconds'] += wait
+        if wait > config.HANDLER_QUEUE_WAIT_WARNING:
+            logger.warning(f'Update waited {wait:.1f}s for a handler worker, {stats()}')
+        try:
+            func(*args)
+        except Exception:
+            logger.exception('Update processing failed')
+        with _lock:
+            _metrics['busy'] -= 1
+            _metrics['done'] += 1
+            waiting = _chats[key]
+            if waiting:
+                task = waiting.popleft()
+            else:
+                del _chats[key]
+                task = None
+
+
+def stats() -> dict:
+    """ Busy workers out of the pool size, queued updates and time they waited for a worker """
+    with _lock:
+        started = _metrics['done'] + _metrics['busy']
+        return dict(_metrics, workers=config.HANDLER_WORKERS, chats=len(_chats),
+                    saturation=_metrics['busy'] / config.HANDLER_WORKERS,
+                    avg_wait_seconds=_metrics['total_wait_seconds'] / started if started else 0.0)
+
+
+def shutdown():
+    """ Wait for updates that were already submitted """
+    if _pool is not None:
+        _pool.shutdown(wait=True)
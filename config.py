@@ -8,4 +8,58 @@ MY_ID = 'Developer chat id'
 # headers for request
 HEADERS = 'Twinword API headers'
 # Database connection URL
-DATABASE_URL = 'Postgres DB URL'
\ No newline at end of file
+DATABASE_URL = 'Postgres DB URL'
+# Postgres connection pool size, DB_POOL_MIN connections stay open with their prepared statements
+DB_POOL_MIN = 4
+DB_POOL_MAX = 10
+# Seconds a pooled connection may stay idle before it is pinged on checkout
+DB_HEALTH_CHECK_INTERVAL = 60
+# Seconds each provider gets before its answer is ignored
+PROVIDER_DEADLINES = {'reverso': 4, 'google': 5, 'conjugator': 4, 'twinword': 5}
+# Threads for concurrent provider calls
+PROVIDER_WORKERS = 16
+# Translation cache: LRU size and lifetime (seconds) of found and not found words
+TRANSLATION_CACHE_SIZE = 10000
+TRANSLATION_CACHE_TTL = 30 * 24 * 3600
+TRANSLATION_CACHE_NEGATIVE_TTL = 24 * 3600
+# Keep-alive connections per host and retries for HTTP providers
+HTTP_POOL_SIZE = 16
+HTTP_RETRIES = 2
+# File in data/ where lemmas learned from conjugator.reverso.net are appended
+LEMMAS_LEARNED_FILE = 'en_lemmas_learned.txt'
+# Vocabulary cache: users kept in memory and common words shared between them
+VOCAB_CACHE_USERS = 1000
+WORDS_CACHE_SIZE = 20000
+# user_actions buffer: events per insert, seconds between flushes, events kept while database is unavailable
+ACTION_LOG_BATCH_SIZE = 200
+ACTION_LOG_FLUSH_INTERVAL = 2
+ACTION_LOG_MAX_BUFFER = 10000
+# Words per /voc page
+VOC_PAGE_SIZE = 50
+# Threads building next /play rounds and seconds an answer waits for a round that is still being built
+PREFETCH_WORKERS = 4
+PREFETCH_WAIT = 1
+# Random words looked at for /play dummies on top of 3 per dummy
+ROUND_SAMPLE_EXTRA = 16
+# Calls per second allowed to each provider
+PROVIDER_RATE_LIMITS = {'reverso': 5, 'google': 5, 'conjugator': 5, 'twinword': 5}
+# /import: max words per file, parallel enrichment workers, seconds between status message edits
+IMPORT_MAX_WORDS = 1000
+IMPORT_WORKERS = 4
+IMPORT_PROGRESS_INTERVAL = 3
+# Threads handling updates (one update per chat at a time) and queue wait in seconds that is logged as a warning
+HANDLER_WORKERS = 8
+HANDLER_QUEUE_WAIT_WARNING = 2
+# Dispatcher threads for run_async handlers (/import)
+ASYNC_WORKERS = 4
+# Threads per provider for its requests, up to twice as many requests wait for them before calls are rejected
+PROVIDER_CALL_WORKERS = 6
+# Providers that get a second request when the first is slower than the latency percentile (Twinword is paid per call)
+PROVIDER_HEDGED = ('reverso', 'google', 'conjugator')
+PROVIDER_HEDGE_PERCENTILE = 0.95
+# Latencies kept per provider and how many of them are needed before hedging starts
+PROVIDER_LATENCY_WINDOW = 200
+PROVIDER_LATENCY_MIN_SAMPLES = 20
+# Failures in a row that open provider circuit and seconds it stays open before a trial call
+PROVIDER_BREAKER_FAILURES = 5
+PROVIDER_BREAKER_COOLDOWN = 30
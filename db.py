@@ -0,0 +1,143 @@
+"""
+ Postgres connection pool shared by all bot handlers.
+ Access stays blocking on purpose: python-telegram-bot 13 handlers are synchronous and run in parallel on
+ chat_workers threads, so an asyncio driver would only add an event loop hop to every query
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the connection itself is broken and must not go back to the pool
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(config.DB_POOL_MAX)  # makes callers wait instead of PoolError
+_last_used = {}  # id(conn) -> time the connection was returned to the pool
+_prepared = {}  # id(conn) -> names of statements prepared on the connection
+
+
+def get_pool():
+    """Create pool on first use so importing the module doesn't need a database"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = pool.ThreadedConnectionPool(config.DB_POOL_MIN, config.DB_POOL_MAX, config.DATABASE_URL)
+    return _pool
+
+
+def _is_alive(conn) -> bool:
+    """Ping connections that were idle for a while, fresh ones are trusted"""
+    if conn.closed:
+        return False
+    if time.monotonic() - _last_used.get(id(conn), 0) < config.DB_HEALTH_CHECK_INTERVAL:
+        return True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('select 1')
+        conn.rollback()
+        return True
+    except CONNECTION_ERRORS:
+        return False
+
+
+def _release(conn, broken=False):
+    _last_used.pop(id(conn), None)
+    if not broken and not conn.closed:
+        _last_used[id(conn)] = time.monotonic()
+    get_pool().putconn(conn, close=broken or bool(conn.closed))
+    if conn.closed:  # the pool also closes connections above DB_POOL_MIN, their statements are gone
+        _prepared.pop(id(conn), None)
+
+
+def _checkout():
+    """Get connection from the pool, replacing dead ones"""
+    for _ in range(config.DB_POOL_MAX + 1):
+        conn = get_pool().getconn()
+        if _is_alive(conn):
+            return conn
+        logger.warning('Dropping dead Postgres connection from the pool')
+        _release(conn, broken=True)
+    raise psycopg2.OperationalError('Could not get a healthy connection from the pool')
+
+
+@contextmanager
+def connection():
+    """Borrow a pooled connection. Broken connections are closed instead of being returned"""
+    with _slots:
+        conn = _checkout()
+        try:
+            yield conn
+        except CONNECTION_ERRORS:
+            _release(conn, broken=True)
+            raise
+        except Exception:
+            try:
+                conn.rollback()
+            except CONNECTION_ERRORS:
+                _release(conn, broken=True)
+                raise
+            _release(conn)
+            raise
+        else:
+            _release(conn)
+
+
+@contextmanager
+def transaction():
+    """
+    Run several statements on one connection in one transaction:
+        with db.transaction() as cursor:
+            cursor.execute(...)
+            cursor.execute(...)
+    Commits on exit, rolls back if the block raises
+    """
+    with connection() as conn:
+        with conn.cursor() as cursor:
+            yield cursor
+        conn.commit()
+
+
+def execute_prepared(cursor, name: str, types: tuple, sql: str, params=()):
+    """
+    Run statement with $1..$n parameters on the cursor as a server-side prepared statement.
+    It's prepared on the first call per connection, later calls only send EXECUTE with the parameters
+    """
+    prepared = _prepared.setdefault(id(cursor.connection), set())
+    if name not in prepared:
+        cursor.execute(f"prepare {name} ({', '.join(types)}) as {sql}" if types else f"prepare {name} as {sql}")
+        prepared.add(name)
+    cursor.execute(f"execute {name} ({', '.join(['%s'] * len(params))})" if params else f"execute {name}", params)
+    return cursor.fetchall() if cursor.description is not None else None
+
+
+def run_prepared(name: str, types: tuple, sql: str, params=()):
+    """ execute_prepared in its own transaction, retried once on a fresh connection if the old one was dropped """
+    for attempt in range(2):
+        try:
+            with transaction() as cursor:
+                return execute_prepared(cursor, name, types, sql, params)
+        except CONNECTION_ERRORS:
+            if attempt:
+                raise
+            logger.warning('Postgres connection lost, reconnecting', exc_info=True)
+
+
+def close_all():
+    """Close every pooled connection, used before restart"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+            _last_used.clear()
+            _prepared.clear()
@@ -14,6 +14,9 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 URLS_SUFFIX = [re.search('translate.google.(.*)', url.strip()).group(1) for url in DEFAULT_SERVICE_URLS]
 URL_SUFFIX_DEFAULT = 'cn'
+# translate_batch limits for one batchexecute request
+BATCH_MAX_ITEMS = 50
+BATCH_MAX_CHARS = 5000
 
 
 class google_new_transError(Exception):
@@ -85,9 +88,16 @@ class google_translator:
     :param proxies: proxies Will be used for every request.
     :type proxies: class : dict; like: {'http': 'http:171.112.169.47:19934/', 'https': 'https:171.112.169.47:19934/'}
 
+    :param session: Session to send requests with, pass a pooled one (http_client.make_session) to keep
+                    connections to translate.google alive. A plain requests.Session is created if not given.
+                    The translator only reads the session, so one instance can be shared between threads.
+    :type session: class : requests.Session
+
     '''
 
-    def __init__(self, url_suffix="cn", timeout=5, proxies=None):
+    def __init__(self, url_suffix="cn", timeout=5, proxies=None, session=None):
+        if proxies == None or type(proxies) != dict:
+            proxies = {}
         self.proxies = proxies
         if url_suffix not in URLS_SUFFIX:
             self.url_suffix = URL_SUFFIX_DEFAULT
@@ -96,6 +106,7 @@ class google_translator:
         url_base = "https://translate.google.{}".format(self.url_suffix)
         self.url = url_base + "/_/TranslateWebserverUi/data/batchexecute"
         self.timeout = timeout
+        self.session = session if session is not None else requests.Session()
 
     def _package_rpc(self, text, lang_src='auto', lang_tgt='auto'):
         GOOGLE_TTS_RPC = ["MkEWBc"]
@@ -108,21 +119,8 @@ class google_translator:
         freq = freq_initial
         return freq
 
-    def translate(self, text, lang_tgt='auto', lang_src='auto', pronounce=False):
-        try:
-            lang = LANGUAGES[lang_src]
-        except:
-            lang_src = 'auto'
-        try:
-            lang = LANGUAGES[lang_tgt]
-        except:
-            lang_src = 'auto'
-        text = str(text)
-        if len(text) >= 5000:
-            return "Warning: Can only detect less than 5000 characters"
-        if len(text) == 0:
-            return ""
-        headers = {
+    def _headers(self):
+        return {
             "Referer": "http://translate.google.{}/".format(self.url_suffix),
             "User-Agent":
                 "Mozilla/5.0 (Windows NT 10.0; WOW64) "
@@ -130,62 +128,27 @@ class google_translator:
                 "Chrome/47.0.2526.106 Safari/537.36",
             "Content-Type": "application/x-www-form-urlencoded;charset=utf-8"
         }
-        freq = self._package_rpc(text, lang_src, lang_tgt)
+
+    def _send_rpc(self, freq):
+        '''
+        Send one batchexecute request and return decoded MkEWBc payload, None if response has no payload
+        '''
         response = requests.Request(method='POST',
                                     url=self.url,
                                     data=freq,
-                                    headers=headers,
+                                    headers=self._headers(),
                                     )
         try:
-            if self.proxies == None or type(self.proxies) != dict:
-                self.proxies = {}
-            with requests.Session() as s:
-                s.proxies = self.proxies
-                r = s.send(request=response.prepare(),
-                           verify=False,
-                           timeout=self.timeout)
+            r = self.session.send(request=response.prepare(),
+                                  proxies=self.proxies,
+                                  verify=False,
+                                  timeout=self.timeout)
             for line in r.iter_lines(chunk_size=1024):
                 decoded_line = line.decode('utf-8')
                 if "MkEWBc" in decoded_line:
-                    try:
-                        response = decoded_line
-                        response = json.loads(response)
-                        response = list(response)
-                        response = json.loads(response[0][2])
-                        response_ = list(response)
-                        response = response_[1][0]
-                        if len(response) == 1:
-                            if len(response[0]) > 5:
-                                sentences = response[0][5]
-                            else: ## only url
-                                sentences = response[0][0]
-                                if pronounce == False:
-                                    return sentences
-                                elif pronounce == True:
-                                    return [sentences,None,None]
-                            translate_text = ""
-                            for sentence in sentences:
-                                sentence = sentence[0]
-                                translate_text += sentence.strip() + ' '
-                            translate_text = translate_text
-                            if pronounce == False:
-                                return translate_text
-                            elif pronounce == True:
-                                pronounce_src = (response_[0][0])
-                                pronounce_tgt = (response_[1][0][0][1])
-                                return [translate_text, pronounce_src, pronounce_tgt]
-                        elif len(response) == 2:
-                            sentences = []
-                            for i in response:
-                                sentences.append(i[0])
-                            if pronounce == False:
-                                return sentences
-                            elif pronounce == True:
-                                pronounce_src = (response_[0][0])
-                                pronounce_tgt = (response_[1][0][0][1])
-                                return [sentences, pronounce_src, pronounce_tgt]
-                    except Exception as e:
-                        raise e
+                    response = json.loads(decoded_line)
+                    response = list(response)
+                    return list(json.loads(response[0][2]))
             r.raise_for_status()
         except requests.exceptions.ConnectTimeout as e:
             raise e
@@ -196,6 +159,168 @@ class google_translator:
             # Request failed
             raise google_new_transError(tts=self)
 
+    def _parse_translation(self, response_, pronounce=False):
+        response = response_[1][0]
+        if len(response) == 1:
+            if len(response[0]) > 5:
+                sentences = response[0][5]
+            else: ## only url
+                sentences = response[0][0]
+                if pronounce == False:
+                    return sentences
+                elif pronounce == True:
+                    return [sentences,None,None]
+            translate_text = ""
+            for sentence in sentences:
+                sentence = sentence[0]
+                translate_text += sentence.strip() + ' '
+            translate_text = translate_text
+            if pronounce == False:
+                return translate_text
+            elif pronounce == True:
+                pronounce_src = (response_[0][0])
+                pronounce_tgt = (response_[1][0][0][1])
+                return [translate_text, pronounce_src, pronounce_tgt]
+        elif len(response) == 2:
+            sentences = []
+            for i in response:
+                sentences.append(i[0])
+            if pronounce == False:
+                return sentences
+            elif pronounce == True:
+                pronounce_src = (response_[0][0])
+                pronounce_tgt = (response_[1][0][0][1])
+                return [sentences, pronounce_src, pronounce_tgt]
+
+    def _check_langs(self, lang_src, lang_tgt):
+        # unknown language codes fall back to detection
+        if lang_src not in LANGUAGES:
+            lang_src = 'auto'
+        if lang_tgt not in LANGUAGES:
+            lang_tgt = 'auto'
+        return lang_src, lang_tgt
+
+    def translate(self, text, lang_tgt='auto', lang_src='auto', pronounce=False):
+        lang_src, lang_tgt = self._check_langs(lang_src, lang_tgt)
+        text = str(text)
+        if len(text) >= 5000:
+            return "Warning: Can only detect less than 5000 characters"
+        if len(text) == 0:
+            return ""
+        freq = self._package_rpc(text, lang_src, lang_tgt)
+        response_ = self._send_rpc(freq)
+        if response_ is not None:
+            return self._parse_translation(response_, pronounce)
+
+    def translate_detect(self, text, lang_tgt='auto', lang_src='auto', pronounce=False):
+        '''
+        Translate text and detect its language with one request instead of detect() + translate().
+        :return: [translation, detected language code] or
+                 [translation, detected language code, pronounce_src, pronounce_tgt] if pronounce is True
+        '''
+        lang_src, lang_tgt = self._check_langs(lang_src, lang_tgt)
+        text = str(text)
+        if len(text) >= 5000:
+            return log.debug("Warning: Can only detect less than 5000 characters")
+        if len(text) == 0:
+            return ["", None, None, None] if pronounce else ["", None]
+        freq = self._package_rpc(text, lang_src, lang_tgt)
+        response_ = self._send_rpc(freq)
+        if response_ is None:
+            return None
+        # source language is reported in the same place detect() reads it from
+        detect_lang = response_[0][2] if response_[0] and len(response_[0]) > 2 else None
+        if detect_lang is None and len(response_) > 2:
+            detect_lang = response_[2]
+        result = self._parse_translation(response_, pronounce)
+        if pronounce:
+            return [result[0], detect_lang, result[1], result[2]]
+        return [result, detect_lang]
+
+    def _package_batch_rpc(self, texts, lang_src='auto', lang_tgt='auto'):
+        # every rpc entry gets its index as identifier, response entries carry it back
+        rpc = [[["MkEWBc", json.dumps([[text.strip(), lang_src, lang_tgt, True], [1]], separators=(',', ':')),
+                 None, str(i)] for i, text in enumerate(texts)]]
+        espaced_rpc = json.dumps(rpc, separators=(',', ':'))
+        return "f.req={}&".format(quote(espaced_rpc))
+
+    def _send_batch_rpc(self, freq):
+        '''
+        Send batchexecute request with several rpc entries and return {identifier: decoded MkEWBc payload}
+        '''
+        response = requests.Request(method='POST',
+                                    url=self.url,
+                                    data=freq,
+                                    headers=self._headers(),
+                                    )
+        try:
+            r = self.session.send(request=response.prepare(),
+                                  proxies=self.proxies,
+                                  verify=False,
+                                  timeout=self.timeout)
+            r.raise_for_status()
+        except requests.exceptions.HTTPError:
+            raise google_new_transError(tts=self, response=r)
+        except requests.exceptions.RequestException:
+            raise google_new_transError(tts=self)
+        payloads = {}
+        for line in r.iter_lines(chunk_size=1024):
+            decoded_line = line.decode('utf-8')
+            if "MkEWBc" not in decoded_line:
+                continue
+            for entry in json.loads(decoded_line):
+                if entry[0] == "wrb.fr" and entry[1] == "MkEWBc" and entry[2]:
+                    payloads[entry[-1]] = list(json.loads(entry[2]))
+        return payloads
+
+    def _batch_chunks(self, items):
+        chunk, chars = [], 0
+        for i, text in items:
+            if chunk and (len(chunk) >= BATCH_MAX_ITEMS or chars + len(text) > BATCH_MAX_CHARS):
+                yield chunk
+                chunk, chars = [], 0
+            chunk.append((i, text))
+            chars += len(text)
+        if chunk:
+            yield chunk
+
+    def translate_batch(self, texts, lang_src='auto', lang_tgt='auto'):
+        '''
+        Translate many texts with as few requests as possible. Texts are packed into batchexecute requests
+        of at most BATCH_MAX_ITEMS entries and BATCH_MAX_CHARS characters.
+        :return: list of [translation, error] in the order of texts, error is None for translated items
+                 and google_new_transError for failed ones
+        '''
+        lang_src, lang_tgt = self._check_langs(lang_src, lang_tgt)
+        texts = [str(text) for text in texts]
+        results = [[None, None] for _ in texts]
+        items = []
+        for i, text in enumerate(texts):
+            if len(text) >= 5000:
+                results[i][1] = google_new_transError("Can only translate less than 5000 characters")
+            elif len(text.strip()) == 0:
+                results[i][0] = ""
+            else:
+                items.append((i, text))
+
+        for chunk in self._batch_chunks(items):
+            try:
+                payloads = self._send_batch_rpc(self._package_batch_rpc([text for _, text in chunk],
+                                                                        lang_src, lang_tgt))
+            except (google_new_transError, ValueError) as e:
+                for i, _ in chunk:
+                    results[i][1] = e if isinstance(e, google_new_transError) else google_new_transError(str(e))
+                continue
+            for position, (i, _) in enumerate(chunk):
+                try:
+                    translated = self._parse_translation(payloads[str(position)])
+                    if translated is None:
+                        raise ValueError("unknown response format")
+                    results[i][0] = translated
+                except Exception as e:
+                    results[i][1] = google_new_transError("No translation in response: {!r}".format(e))
+        return results
+
     def detect(self, text):
         text = str(text)
         if len(text) >= 5000:
@@ -216,13 +341,10 @@ class google_translator:
                                     data=freq,
                                     headers=headers)
         try:
-            if self.proxies == None or type(self.proxies) != dict:
-                self.proxies = {}
-            with requests.Session() as s:
-                s.proxies = self.proxies
-                r = s.send(request=response.prepare(),
-                           verify=False,
-                           timeout=self.timeout)
+            r = self.session.send(request=response.prepare(),
+                                  proxies=self.proxies,
+                                  verify=False,
+                                  timeout=self.timeout)
 
             for line in r.iter_lines(chunk_size=1024):
                 decoded_line = line.decode('utf-8')
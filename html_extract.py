@@ -0,0 +1,128 @@
+"""
+ Targeted extraction from reverso pages without building a document tree.
+ The response is read in chunks and fed to an incremental parser that only keeps text of the wanted elements,
+ parsing stops as soon as enough of them were found.
+ A connection closed in the middle of a body can't go back to the keep-alive pool, and the next request to the host
+ pays TCP/TLS setup again. So up to DRAIN_SIZE bytes of the rest are read without parsing to keep the connection,
+ for longer remainders a new handshake is cheaper than downloading the rest of the page.
+"""
+import codecs
+from html.parser import HTMLParser
+
+CHUNK_SIZE = 16 * 1024
+# bytes of the page read past the wanted elements to keep the connection, longer remainders close it
+DRAIN_SIZE = 64 * 1024
+
+
+class Selector:
+    """ Element with `tag`, containing `cls` in its class list and having every attribute of `attrs` """
+
+    def __init__(self, tag: str, cls: str = None, **attrs):
+        self.tag = tag
+        self.cls = cls
+        self.attrs = attrs
+
+    def match(self, tag, attrs) -> bool:
+        if tag != self.tag:
+            return False
+        attrs = dict(attrs)
+        if self.cls is not None and self.cls not in (attrs.get('class') or '').split():
+            return False
+        return all(attrs.get(name) == value for name, value in self.attrs.items())
+
+
+class _Extractor(HTMLParser):
+    """ Collects stripped text of elements matching the selectors, `limits` caps results per selector """
+
+    def __init__(self, selectors, limits):
+        super().__init__(convert_charrefs=True)
+        self.selectors = selectors
+        self.limits = limits
+        self.results = [[] for _ in selectors]
+        self.current = None  # [selector index, tag, depth of nested tags with the same name, text parts]
+
+    @property
+    def done(self) -> bool:
+        """ Every capped selector is full, selectors without a cap only collect what was read by then """
+        capped = [(found, limit) for found, limit in zip(self.results, self.limits) if limit is not None]
+        return bool(capped) and all(len(found) >= limit for found, limit in capped)
+
+    def handle_starttag(self, tag, attrs):
+        if self.current is not None:
+            if tag == self.current[1]:
+                self.current[2] += 1
+            return
+        for i, selector in enumerate(self.selectors):
+            if (self.limits[i] is None or len(self.results[i]) < self.limits[i]) and selector.match(tag, attrs):
+                self.current = [i, tag, 0, []]
+                return
+
+    def handle_endtag(self, tag):
+        if self.current is None or tag != self.current[1]:
+            return
+        if self.current[2]:
+            self.current[2] -= 1
+            return
+        i, _, _, parts = self.current
+        self.results[i].append(''.join(parts).strip())
+        self.current = None
+
+    def handle_data(self, data):
+        if self.current is not None:
+            self.current[3].append(data)
+
+
+def extract(response, selectors: list, limits: list) -> list:
+    """
+    Text of elements matching each selector, in page order, read from a requests response opened with stream=True.
+    limits[i] caps results of selectors[i] or is None. Reading stops once every capped selector is full,
+    with no caps the whole page is read.
+    :return: list of text lists, one per selector
+    """
+    parser = _Extractor(selectors, limits)
+    # requests falls back to latin-1 for text/html without charset, reverso pages are utf-8
+    charset = response.encoding if 'charset=' in response.headers.get('Content-Type', '').lower() else 'utf-8'
+    decoder = codecs.getincrementaldecoder(charset)(errors='replace')
+    chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+    try:
+        for chunk in chunks:
+            parser.feed(decoder.decode(chunk))
+            if parser.done:
+                _drain(chunks)
+                break
+        else:
+            parser.feed(decoder.decode(b'', final=True))
+            parser.close()
+    finally:
+        response.close()
+    return parser.results
+
+
+def _drain(chunks):
+    """ Read the rest of the body unparsed if it's at most DRAIN_SIZE bytes, a fully read body frees the connection """
+    drained = 0
+    for chunk in chunks:
+        drained += len(chunk)
+        if drained > DRAIN_SIZE:
+            return
+
+
+TRANSLATION_LINK = Selector('a', 'translation')
+TRANSLATION_BLOCK = Selector('div', 'translation')
+INFINITIVE = Selector('a', 'targetted-word-transl', tooltip='Existing infinitive')
+
+
+def translations(response, limit: int = None) -> list:
+    """
+    Translations from a context.reverso.net page, links first and then blocks like the page lists them.
+    The first link is the 'Translation' header and is skipped. With limit, reading stops after `limit` links
+    """
+    links, blocks = extract(response, [TRANSLATION_LINK, TRANSLATION_BLOCK],
+                            [limit + 1 if limit is not None else None, None])
+    return (links[1:] + blocks)[:limit]
+
+
+def infinitive(response):
+    """ Infinitive from a conjugator.reverso.net page, None if the word has no infinitive """
+    found, = extract(response, [INFINITIVE], [1])
+    return found[0] if found else None
@@ -0,0 +1,31 @@
+"""
+ Shared keep-alive HTTP client for scraping and API providers
+"""
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import config
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def make_session(pool_size: int, retries: int, backoff: float = 0.3) -> requests.Session:
+    """
+    Session with a bounded connection pool per host and retries on connection errors and 5xx/429.
+    Connections are reused between calls, so only the first request to a host pays DNS/TCP/TLS setup.
+    The pool blocks when all connections are busy, which makes the session safe to share between worker threads
+    as long as callers don't change session attributes after creation
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True,
+                          max_retries=Retry(total=retries, backoff_factor=backoff, status_forcelist=RETRY_STATUSES,
+                                            raise_on_status=False))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = 'Mozilla/5.0'
+    return session
+
+
+# reverso and Twinword calls go through this session
+session = make_session(config.HTTP_POOL_SIZE, config.HTTP_RETRIES)
@@ -0,0 +1,113 @@
+"""
+ Offline English lemma index: inflected form -> infinitive.
+ Built on first use from the bundled irregular verbs list and forms learned from conjugator.reverso.net,
+ regular -s/-ed/-ing forms are resolved with suffix rules against known infinitives.
+"""
+import os
+import threading
+
+import config
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+IRREGULAR_VERBS_PATH = os.path.join(DATA_DIR, 'en_irregular_verbs.txt')
+
+_forms = None  # form -> infinitive, infinitives and non-verbs map to themselves
+_infinitives = set()  # known verbs, suffix rules only produce these
+_irregular = set()  # infinitives from the irregular list, their past forms are listed and never end in -ed
+_lock = threading.Lock()
+
+
+def _learned_path():
+    return os.path.join(DATA_DIR, config.LEMMAS_LEARNED_FILE)
+
+
+def _load():
+    forms = {}
+    with open(IRREGULAR_VERBS_PATH, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip() or line.startswith('#'):
+                continue
+            lemma, *inflected = line.split()
+            for column in inflected:
+                for form in column.split('/'):
+                    forms.setdefault(form, lemma)
+            forms[lemma] = lemma  # infinitive always wins over a coinciding past form (lay, found...)
+            _infinitives.add(lemma)
+            _irregular.add(lemma)
+    if os.path.exists(_learned_path()):
+        with open(_learned_path(), encoding='utf-8') as f:
+            for line in f:
+                parts = line.split()  # "form infinitive" for verbs, single "word" for words without infinitive
+                if len(parts) == 2:
+                    forms.setdefault(parts[0], parts[1])
+                    forms.setdefault(parts[1], parts[1])
+                    _infinitives.add(parts[1])
+                elif len(parts) == 1:
+                    forms.setdefault(parts[0], parts[0])
+    return forms
+
+
+def _index():
+    global _forms
+    if _forms is None:
+        with _lock:
+            if _forms is None:
+                _forms = _load()
+    return _forms
+
+
+def _stems(stem):
+    yield stem
+    yield stem + 'e'  # making, baked
+    if len(stem) > 2 and stem[-1] == stem[-2]:
+        yield stem[:-1]  # running, stopped
+
+
+def _regular_candidates(word):
+    """ Possible infinitives of a regular -s/-es/-ies/-ed/-ing form as (infinitive, is past form) """
+    if word.endswith('ies'):
+        yield word[:-3] + 'y', False
+    if word.endswith('es') and word[:-2].endswith(('s', 'x', 'z', 'ch', 'sh', 'o')):
+        yield word[:-2], False  # watches, goes, but not bees
+    if word.endswith('s') and not word.endswith('ss'):
+        yield word[:-1], False
+    if word.endswith('ing'):
+        stem = word[:-3]
+        if stem.endswith('y'):
+            yield stem[:-1] + 'ie', False  # lying
+        yield from ((candidate, False) for candidate in _stems(stem))
+    if word.endswith('ed'):
+        stem = word[:-2]
+        if stem.endswith('i'):
+            yield stem[:-1] + 'y', True  # studied
+        yield from ((candidate, True) for candidate in _stems(stem))
+
+
+def lookup(word: str):
+    """ Infinitive of the word, the word itself if it isn't a verb form, None if the index doesn't know it """
+    forms = _index()
+    lemma = forms.get(word)
+    if lemma is not None:
+        return lemma
+    for candidate, past in _regular_candidates(word):
+        # irregular verbs have their past forms listed, so bed/seed aren't be/see
+        if candidate in _infinitives and not (past and candidate in _irregular):
+            return candidate
+    return None
+
+
+def remember(form: str, lemma=None):
+    """
+    Write network lookup result back to the index so the next lookup of this form stays local.
+    lemma is None for words that have no infinitive
+    """
+    forms = _index()
+    with _lock:
+        if form in forms and (lemma is None or forms[form] == lemma):
+            return
+        forms[form] = lemma or form
+        if lemma is not None:
+            forms.setdefault(lemma, lemma)
+            _infinitives.add(lemma)
+        with open(_learned_path(), 'a', encoding='utf-8') as f:
+            f.write(f'{form} {lemma}\n' if lemma is not None else f'{form}\n')
@@ -0,0 +1,30 @@
+"""
+ Bundled read-only en<->ru lexicon of common words, checked before any network provider.
+ Index is built by build_lexicon.py, and on first use if it's missing
+"""
+import os
+import sqlite3
+import threading
+
+import build_lexicon
+
+_local = threading.local()  # sqlite connection per thread
+_build_lock = threading.Lock()
+
+
+def _connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        with _build_lock:
+            if not os.path.exists(build_lexicon.INDEX_PATH):
+                build_lexicon.build()
+        conn = sqlite3.connect(f'file:{build_lexicon.INDEX_PATH}?mode=ro&immutable=1', uri=True)
+        _local.conn = conn
+    return conn
+
+
+def lookup(word: str, direction: str):
+    """ Translation of the word or None if it's not in the lexicon. direction is 'en-ru' or 'ru-en' """
+    record = _connection().execute("select translation from lexicon where word = ? and direction = ?",
+                                   (word.strip().lower(), direction)).fetchone()
+    return record[0] if record else None
@@ -0,0 +1,224 @@
+"""
+ Versioned, non-destructive schema migrations:
+    python migrate.py status  - show applied and pending migrations
+    python migrate.py apply   - apply pending migrations
+ Every statement is idempotent, so a migration that failed halfway can simply be applied again.
+ Migrations with transaction=False run statement by statement in autocommit, which lets indexes be built
+ concurrently while the bot keeps writing to the tables.
+"""
+import re
+import sys
+
+import psycopg2
+
+import config
+
+MIGRATIONS = [
+    {
+        'version': 1,
+        'name': 'base tables',
+        'transaction': True,
+        'sql': [
+            """create table if not exists user_actions
+               (
+               uid varchar(20),
+               action varchar(30),
+               dttm timestamp default (now())
+               );""",
+            """create table if not exists user_words
+               (
+               uid varchar(20),
+               word varchar(30),
+               edit varchar(30),
+               is_edited boolean default false,
+               is_deleted boolean default false,
+               translation_score int4 default (0)
+               );""",
+            """create table if not exists words
+               (
+               word varchar(30),
+               meaning varchar(30),
+               examples text[]
+               );""",
+            """create table if not exists games
+               (
+               uid int,
+               word varchar(30),
+               answer_var int,
+               translation_score int,
+               meaning varchar(50)
+               );""",
+            """create table if not exists users
+               (
+               uid int,
+               first_name varchar(30),
+               last_name varchar(30),
+               username varchar(30)
+               );""",
+            """create table if not exists translation_cache
+               (
+               word varchar(100),
+               direction varchar(5),
+               result varchar(100),
+               is_found boolean,
+               updated_at timestamp default (now()),
+               primary key (word, direction)
+               );""",
+        ],
+    },
+    {
+        'version': 2,
+        'name': 'unique keys for words, user_words, games and users',
+        'transaction': False,
+        'sql': [
+            # duplicates left by concurrent inserts have to go before unique indexes can be built
+            "delete from words a using words b where a.word = b.word and a.ctid < b.ctid;",
+            """delete from user_words a using user_words b
+               where a.uid = b.uid and a.word = b.word
+                 and (a.translation_score, a.ctid) < (b.translation_score, b.ctid);""",
+            "delete from games a using games b where a.uid = b.uid and a.ctid < b.ctid;",
+            "delete from users a using users b where a.uid = b.uid and a.ctid < b.ctid;",
+            "create unique index concurrently if not exists words_word_key on words (word);",
+            "create unique index concurrently if not exists user_words_uid_word_key on user_words (uid, word);",
+            "create unique index concurrently if not exists games_uid_key on games (uid);",
+            "create unique index concurrently if not exists users_uid_key on users (uid);",
+        ],
+    },
+    {
+        'version': 3,
+        'name': 'indexes for user_actions and active user_words',
+        'transaction': False,
+        'sql': [
+            "create index concurrently if not exists user_actions_uid_dttm_idx on user_actions (uid, dttm);",
+            """create index concurrently if not exists user_words_active_idx on user_words (uid)
+               where is_deleted = False;""",
+        ],
+    },
+    {
+        'version': 4,
+        'name': 'daily statistics rollup, filled by backfill_stats.py',
+        'transaction': True,
+        'sql': [
+            """create table if not exists user_daily_stats
+               (
+               uid varchar(20),
+               day date,
+               wins int default (0),
+               losses int default (0),
+               mastered int default (0),
+               added int default (0),
+               primary key (uid, day)
+               );""",
+        ],
+    },
+    {
+        'version': 5,
+        'name': 'spaced repetition schedule for user_words',
+        'transaction': True,
+        'sql': [
+            # constant defaults don't rewrite the table
+            "alter table user_words add column if not exists due_at timestamp default (now());",
+            "alter table user_words add column if not exists interval_days real default (0);",
+            "alter table user_words add column if not exists ease real default (2.5);",
+            "alter table user_words add column if not exists repetitions int default (0);",
+        ],
+    },
+]
+
+CONCURRENT_INDEX = re.compile(r'create (?:unique )?index concurrently if not exists (\w+)', re.IGNORECASE)
+
+
+def connect():
+    conn = psycopg2.connect(config.DATABASE_URL)
+    with conn.cursor() as cursor:
+        cursor.execute("""create table if not exists schema_migrations
+                          (
+                          version int primary key,
+                          name text,
+                          applied_at timestamp default (now())
+                          );""")
+    conn.commit()
+    return conn
+
+
+def applied_versions(conn) -> dict:
+    with conn.cursor() as cursor:
+        cursor.execute("select version, applied_at from schema_migrations;")
+        return dict(cursor.fetchall())
+
+
+def _drop_invalid_index(cursor, name):
+    """ Failed concurrent build leaves an invalid index behind, 'if not exists' would keep it forever """
+    cursor.execute("""select 1 from pg_index i join pg_class c on c.oid = i.indexrelid
+                      where c.relname = %s and not i.indisvalid;""", (name,))
+    if cursor.fetchone():
+        cursor.execute(f"drop index concurrently if exists {name};")
+
+
+def apply_migration(conn, migration):
+    if migration['transaction']:
+        with conn.cursor() as cursor:
+            cursor.execute("set local lock_timeout = '5s';")  # don't queue handlers behind a long lock wait
+            for statement in migration['sql']:
+                cursor.execute(statement)
+            cursor.execute("insert into schema_migrations (version, name) values (%s, %s);",
+                           (migration['version'], migration['name']))
+        conn.commit()
+        return
+
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            for statement in migration['sql']:
+                index = CONCURRENT_INDEX.search(statement)
+                if index:
+                    _drop_invalid_index(cursor, index.group(1))
+                cursor.execute(statement)
+            cursor.execute("insert into schema_migrations (version, name) values (%s, %s);",
+                           (migration['version'], migration['name']))
+    finally:
+        conn.autocommit = False
+
+
+def status(conn):
+    applied = applied_versions(conn)
+    for migration in MIGRATIONS:
+        state = f"applied {applied[migration['version']]}" if migration['version'] in applied else 'pending'
+        print(f"{migration['version']:>4}  {migration['name']:<55} {state}")
+
+
+def apply(conn):
+    applied = applied_versions(conn)
+    pending = [m for m in MIGRATIONS if m['version'] not in applied]
+    if not pending:
+        print('Schema is up to date')
+    for migration in pending:
+        print(f"Applying {migration['version']}: {migration['name']}")
+        apply_migration(conn, migration)
+
+
+def pending_versions() -> list:
+    """ Versions that aren't applied yet, the bot checks it at startup """
+    conn = connect()
+    try:
+        applied = applied_versions(conn)
+    finally:
+        conn.close()
+    return [m['version'] for m in MIGRATIONS if m['version'] not in applied]
+
+
+def main(argv):
+    command = argv[0] if argv else 'status'
+    if command not in ('status', 'apply'):
+        print(__doc__)
+        return 1
+    conn = connect()
+    try:
+        status(conn) if command == 'status' else apply(conn)
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,237 @@
+"""
+ Shared limits for external providers (reverso, conjugator, google, twinword).
+ Every provider request goes through call(), which applies the rate limit, the deadline, a hedged second request
+ for slow answers and a circuit breaker that skips a provider for a while after failures in a row
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+import config
+import http_client
+
+
+class ProviderUnavailable(Exception):
+    """ Provider gave no answer: its circuit is open or the call failed, unlike "nothing found" it isn't cached """
+
+
+class RateLimiter:
+    """ Token bucket: at most `rate` calls per second on average, bursts up to `rate` calls """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """ Take a token, waiting for one if the bucket is empty """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failures` failed calls in a row and rejects calls for `cooldown` seconds.
+    Then one trial call is let through: success closes the circuit, failure opens it again
+    """
+
+    def __init__(self, failures: int, cooldown: float):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if not self.trial and time.monotonic() - self.opened_at >= self.cooldown:
+                self.trial = True
+                return True
+            return False
+
+    def success(self):
+        with self.lock:
+            self.failures, self.opened_at, self.trial = 0, None, False
+
+    def failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            return 'closed' if self.opened_at is None else 'half-open' if self.trial else 'open'
+
+
+limiters = {provider: RateLimiter(rate) for provider, rate in config.PROVIDER_RATE_LIMITS.items()}
+breakers = {provider: CircuitBreaker(config.PROVIDER_BREAKER_FAILURES, config.PROVIDER_BREAKER_COOLDOWN)
+            for provider in config.PROVIDER_DEADLINES}
+
+# every provider has its own threads, so a stalled one can't take the threads of the others
+_pools = {provider: ThreadPoolExecutor(max_workers=config.PROVIDER_CALL_WORKERS, thread_name_prefix=provider)
+          for provider in config.PROVIDER_DEADLINES}
+_in_flight = {provider: 0 for provider in config.PROVIDER_DEADLINES}  # submitted attempts that haven't finished
+_latencies = {provider: deque(maxlen=config.PROVIDER_LATENCY_WINDOW) for provider in config.PROVIDER_DEADLINES}
+_counters = {provider: {'calls': 0, 'errors': 0, 'timeouts': 0, 'rejected': 0, 'hedged': 0, 'hedge_wins': 0}
+             for provider in config.PROVIDER_DEADLINES}
+_lock = threading.Lock()
+
+
+def throttle(provider: str):
+    """ Wait until the provider's rate limit allows one more call """
+    limiter = limiters.get(provider)
+    if limiter is not None:
+        limiter.acquire()
+
+
+def _count(provider, name):
+    with _lock:
+        _counters[provider][name] += 1
+
+
+def _record_latency(provider, seconds):
+    with _lock:
+        _latencies[provider].append(seconds)
+
+
+def _percentile(provider, share):
+    with _lock:
+        latencies = sorted(_latencies[provider])
+    if not latencies:
+        return None
+    return latencies[min(len(latencies) - 1, int(share * len(latencies)))]
+
+
+def _hedge_delay(provider):
+    """ Seconds after which a second request is sent, None if the provider isn't hedged or has too few samples """
+    if provider not in config.PROVIDER_HEDGED:
+        return None
+    with _lock:
+        if len(_latencies[provider]) < config.PROVIDER_LATENCY_MIN_SAMPLES:
+            return None
+    delay = _percentile(provider, config.PROVIDER_HEDGE_PERCENTILE)
+    return delay if delay < config.PROVIDER_DEADLINES[provider] else None
+
+
+def is_outage(error) -> bool:
+    """
+    Error means the provider is down or overloaded: connection error, timeout, 5xx or 429, also when it was wrapped
+    into another exception. Other errors, like a 404 or an answer without the expected fields, come from a working
+    provider that had nothing for this request and don't count towards the circuit breaker
+    """
+    while error is not None:
+        if isinstance(error, requests.HTTPError):
+            return error.response is None or error.response.status_code in http_client.RETRY_STATUSES
+        if isinstance(error, (requests.ConnectionError, requests.Timeout, TimeoutError)):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def _attempt(provider, func, args):
+    try:
+        throttle(provider)
+        started = time.monotonic()
+        result = func(*args)
+        _record_latency(provider, time.monotonic() - started)
+        return result
+    finally:
+        with _lock:
+            _in_flight[provider] -= 1
+
+
+def _submit(provider, func, args, limit):
+    """ Start an attempt unless the provider already has `limit` attempts in flight. None if it has """
+    with _lock:
+        if _in_flight[provider] >= limit:
+            return None
+        _in_flight[provider] += 1
+    return _pools[provider].submit(_attempt, provider, func, args)
+
+
+def call(provider: str, func, *args):
+    """
+    Result of func(*args) for the provider within its deadline.
+    If the first request is slower than the provider's latency percentile, an identical second request is sent
+    and the first answer wins. Raises TimeoutError after the deadline, ProviderUnavailable while the circuit is open
+    and the request's own exception if it failed. Only timeouts and errors that pass is_outage open the circuit
+    """
+    breaker = breakers[provider]
+    if not breaker.allow():
+        _count(provider, 'rejected')
+        raise ProviderUnavailable(f'{provider} is skipped after repeated failures')
+    # stalled attempts keep their thread until the HTTP timeout, queue only as many as the threads can take
+    first = _submit(provider, func, args, 2 * config.PROVIDER_CALL_WORKERS)
+    if first is None:
+        _count(provider, 'rejected')
+        raise ProviderUnavailable(f'{provider} has too many requests in flight')
+    _count(provider, 'calls')
+    started = time.monotonic()
+    deadline = started + config.PROVIDER_DEADLINES[provider]
+    hedge_delay = _hedge_delay(provider)
+    pending, error = {first}, None
+    while pending:
+        wait_until = deadline if hedge_delay is None else min(deadline, started + hedge_delay)
+        done, pending = wait(pending, timeout=max(0.0, wait_until - time.monotonic()), return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except Exception as e:
+                error = e
+                continue
+            for other in pending:
+                other.cancel()
+            if future is not first:
+                _count(provider, 'hedge_wins')
+            breaker.success()
+            return result
+        if time.monotonic() >= deadline:
+            break
+        if not done and hedge_delay is not None:  # first request is slow, race it with a second one
+            hedge_delay = None
+            hedge = _submit(provider, func, args, config.PROVIDER_CALL_WORKERS)  # only into a free thread
+            if hedge is not None:
+                _count(provider, 'hedged')
+                pending.add(hedge)
+
+    if pending:
+        breaker.failure()
+        _count(provider, 'timeouts')
+        _record_latency(provider, config.PROVIDER_DEADLINES[provider])  # slow answers count in the percentile
+        raise TimeoutError(f'{provider} missed its {config.PROVIDER_DEADLINES[provider]}s deadline')
+    _count(provider, 'errors')
+    if is_outage(error):
+        breaker.failure()
+    else:  # the provider answered, only not with what the caller wanted
+        breaker.success()
+    raise error
+
+
+def stats() -> dict:
+    """ Per provider counters, p50/p95 latency and circuit state """
+    result = {}
+    for provider in config.PROVIDER_DEADLINES:
+        with _lock:
+            counters = dict(_counters[provider], in_flight=_in_flight[provider])
+        p50, p95 = _percentile(provider, 0.5), _percentile(provider, 0.95)
+        result[provider] = dict(counters, p50_seconds=p50 or 0.0, p95_seconds=p95 or 0.0,
+                                circuit=breakers[provider].state)
+    return result
@@ -0,0 +1,102 @@
+"""
+ Every statement the bot runs against Postgres, defined once with typed $1..$n bind parameters.
+ Statements run as server-side prepared statements, so Postgres parses and plans each of them once per pooled
+ connection and values never end up inside the SQL text:
+    rows = queries.run(queries.GAME, uid)
+ Multi-row inserts (action_log, /import) stay on execute_values, their text depends on the batch size.
+"""
+from collections import namedtuple
+
+import db
+
+Statement = namedtuple('Statement', 'name types sql')
+
+# users, uid is int in users and games
+KNOWN_USERS = Statement('known_users', (), "select uid from users")
+LOG_USER = Statement('log_user', ('int', 'varchar', 'varchar', 'varchar'),
+                     """insert into users (uid, first_name, last_name, username) values ($1, $2, $3, $4)
+                        on conflict (uid) do nothing""")
+
+# words
+COMMON_WORD = Statement('common_word', ('varchar',), "select meaning, examples from words where word = $1 limit 1")
+KNOWN_WORDS = Statement('known_words', ('text[]',), "select word from words where word = any($1)")
+INSERT_COMMON_WORD = Statement('insert_common_word', ('varchar', 'varchar', 'text[]'),
+                               """insert into words (word, meaning, examples) values ($1, $2, $3)
+                                  on conflict (word) do nothing
+                                  returning word""")
+
+# user_words, examples aren't loaded with the vocabulary, common_word() reads them for the words that need them
+USER_ROWS = Statement('user_rows', ('varchar',),
+                      """select uw.word,
+                                case when uw.is_edited then uw.edit else w.meaning end,
+                                uw.translation_score,
+                                uw.is_deleted,
+                                coalesce(array_length(w.examples, 1), 0) > 0,
+                                uw.due_at,
+                                uw.interval_days,
+                                uw.ease,
+                                uw.repetitions
+                         from user_words uw left join words w on w.word = uw.word
+                         where uw.uid = $1""")
+ADD_USER_WORD = Statement('add_user_word', ('varchar', 'varchar'),
+                          """insert into user_words (uid, word) values ($1, $2)
+                             on conflict (uid, word) do update set is_deleted = False
+                             returning due_at""")
+ADD_MANUAL_WORD = Statement('add_manual_word', ('varchar', 'varchar', 'varchar'),
+                            """insert into user_words (uid, word, is_edited, edit) values ($1, $2, True, $3)
+                               on conflict (uid, word) do update
+                                 set is_deleted = False, is_edited = True, edit = excluded.edit
+                               returning due_at""")
+EDIT_WORD = Statement('edit_word', ('varchar', 'varchar', 'varchar'),
+                      "update user_words set is_edited = True, edit = $3 where uid = $1 and word = $2")
+DELETE_WORD = Statement('delete_word', ('varchar', 'varchar'),
+                        "update user_words set is_deleted = True where uid = $1 and word = $2")
+SCORE_WORD = Statement('score_word', ('varchar', 'varchar', 'int', 'boolean', 'real', 'real', 'int'),
+                       """update user_words
+                          set translation_score = $3,
+                              is_deleted = is_deleted or $4,
+                              interval_days = $5,
+                              ease = $6,
+                              repetitions = $7,
+                              due_at = now() + $5 * interval '1 day'
+                          where uid = $1 and word = $2
+                          returning due_at""")
+
+# games
+LAST_GAME_WORD = Statement('last_game_word', ('int',), "select max(word) from games where uid = $1")
+INIT_GAME = Statement('init_game', ('int',),
+                      """insert into games (uid, word, answer_var, translation_score, meaning) values ($1, '', 0, 0, '')
+                         on conflict (uid) do nothing""")
+SET_GAME = Statement('set_game', ('int', 'varchar', 'int', 'int', 'varchar'),
+                     """update games
+                        set word = $2, answer_var = $3, translation_score = $4, meaning = $5
+                        where uid = $1""")
+GAME = Statement('game', ('int',), "select word, answer_var, translation_score, meaning from games where uid = $1")
+
+# user_daily_stats
+WEEKLY_STATS = Statement('weekly_stats', ('varchar',),
+                         """select coalesce(sum(wins + losses), 0), coalesce(sum(wins), 0), coalesce(sum(mastered), 0)
+                            from user_daily_stats where uid = $1 and day > current_date - 7""")
+
+# translation_cache
+CACHED_TRANSLATION = Statement('cached_translation', ('varchar', 'varchar', 'int', 'int'),
+                               """select result,
+                                         extract(epoch from updated_at + make_interval(secs => case when is_found
+                                                                                     then $3 else $4 end) - now())
+                                  from translation_cache
+                                  where word = $1 and direction = $2""")
+CACHE_TRANSLATION = Statement('cache_translation', ('varchar', 'varchar', 'varchar', 'boolean'),
+                              """insert into translation_cache (word, direction, result, is_found)
+                                 values ($1, $2, $3, $4)
+                                 on conflict (word, direction) do update
+                                   set result = excluded.result, is_found = excluded.is_found, updated_at = now()""")
+
+
+def run(statement: Statement, *params):
+    """ Run statement in its own transaction, returns fetched rows if it produces any """
+    return db.run_prepared(statement.name, statement.types, statement.sql, params)
+
+
+def execute(cursor, statement: Statement, *params):
+    """ Run statement on the cursor of an open db.transaction() """
+    return db.execute_prepared(cursor, statement.name, statement.types, statement.sql, params)
@@ -0,0 +1,30 @@
+"""
+ Offline Russian normal forms. pymorphy2 keeps the OpenCorpora dictionary in DAWG files,
+ so normalization is a local lookup instead of a request to opencorpora.org
+"""
+import re
+import threading
+
+import pymorphy2
+
+_morph = None
+_lock = threading.Lock()
+
+
+def load():
+    """ Load dictionaries, called once at startup so the first word doesn't pay for it """
+    global _morph
+    if _morph is None:
+        with _lock:
+            if _morph is None:
+                _morph = pymorphy2.MorphAnalyzer()
+    return _morph
+
+
+def normalize(word: str) -> str:
+    """ Normal form of a single russian word, anything else is returned unchanged apart from outer spaces """
+    word = word.strip()
+    if not re.fullmatch(r'[\u0400-\u04FF-]+', word):
+        return word
+    parses = load().parse(word)
+    return parses[0].normal_form if parses else word
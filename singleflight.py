@@ -0,0 +1,43 @@
+"""
+ In-process single-flight: concurrent calls with the same key share one execution.
+ The first caller runs the function, the others wait for its result or exception. Nothing is cached,
+ a call that starts after the flight has landed runs the function again.
+"""
+import threading
+from concurrent.futures import Future
+
+_flights = {}  # key -> Future of the running call
+_lock = threading.Lock()
+_metrics = {'calls': 0, 'shared': 0}
+
+
+def do(key, func, *args, **kwargs):
+    """ Result of func(*args, **kwargs), or of the call with the same key that is already running """
+    with _lock:
+        _metrics['calls'] += 1
+        future = _flights.get(key)
+        leader = future is None
+        if leader:
+            future = _flights[key] = Future()
+        else:
+            _metrics['shared'] += 1
+    if not leader:
+        return future.result()
+
+    try:
+        result = func(*args, **kwargs)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _lock:
+            del _flights[key]
+
+
+def stats() -> dict:
+    """ Calls made and calls that joined a running flight """
+    with _lock:
+        return dict(_metrics, in_flight=len(_flights))
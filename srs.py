@@ -0,0 +1,23 @@
+"""
+ SM-2 spaced repetition. Every /play answer is a review: right answer counts as quality 4, wrong one as quality 1
+"""
+START_EASE = 2.5
+MIN_EASE = 1.3
+CORRECT_QUALITY = 4
+WRONG_QUALITY = 1
+
+
+def review(interval: float, ease: float, repetitions: int, correct: bool):
+    """
+    Next review parameters of a word.
+    :return: (days until the word is due again, new ease factor, successful repetitions in a row)
+    """
+    quality = CORRECT_QUALITY if correct else WRONG_QUALITY
+    if quality >= 3:
+        interval = 1 if repetitions == 0 else 6 if repetitions == 1 else interval * ease
+        repetitions += 1
+    else:
+        # SM-2 repeats failed items in the same session, so the word is due right away
+        interval, repetitions = 0, 0
+    ease = max(MIN_EASE, ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return interval, ease, repetitions
@@ -0,0 +1,75 @@
+import json
+import os
+from urllib.parse import parse_qs
+
+import pytest
+
+google_trans_new = pytest.importorskip('google_trans_new')
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, body: bytes):
+        self.body = body
+
+    def iter_lines(self, chunk_size=512):
+        return iter(self.body.splitlines())
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSession:
+    """ Answers batchexecute requests with `respond(rpc entries)` and keeps the sent entries """
+
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        entries = json.loads(parse_qs(request.body)['f.req'][0])[0]
+        self.requests.append(entries)
+        return FakeResponse(self.respond(entries))
+
+
+def recorded(entries):
+    with open(os.path.join(FIXTURES, 'google_batchexecute_cat_dog_house.txt'), 'rb') as f:
+        return f.read()
+
+
+def echo(entries):
+    """ Every entry translated to its text with '-ru' appended, answers in reverse order """
+    lines = [b")]}'", b'']
+    for entry in reversed(entries):
+        text = json.loads(entry[1])[0][0]
+        payload = [[None, None, 'en'], [[[None, None, None, True, None, [[text + '-ru', None]]]], 'ru']]
+        lines.append(json.dumps([['wrb.fr', 'MkEWBc', json.dumps(payload), None, None, None, entry[3]]]).encode())
+    return b'\n'.join(lines)
+
+
+def test_batch_response_is_mapped_by_identifier():
+    session = FakeSession(recorded)
+    translator = google_trans_new.google_translator(session=session)
+    results = translator.translate_batch(['cat', 'dog', 'house'], lang_tgt='ru')
+    assert [entry[3] for entry in session.requests[0]] == ['0', '1', '2']
+    assert results[0] == ['кот ', None]
+    assert results[1][0] is None and isinstance(results[1][1], google_trans_new.google_new_transError)
+    assert results[2] == ['дом ', None]
+
+
+def test_chunks_keep_text_order(monkeypatch):
+    monkeypatch.setattr(google_trans_new, 'BATCH_MAX_ITEMS', 2)
+    session = FakeSession(echo)
+    translator = google_trans_new.google_translator(session=session)
+    results = translator.translate_batch(['cat', '', 'dog', 'house', 'tree'], lang_tgt='ru')
+    assert len(session.requests) == 2
+    assert results == [['cat-ru ', None], ['', None], ['dog-ru ', None], ['house-ru ', None], ['tree-ru ', None]]
+
+
+def test_unknown_languages_fall_back_to_detection():
+    translator = google_trans_new.google_translator(session=FakeSession(echo))
+    assert translator._check_langs('xx', 'ru') == ('auto', 'ru')
+    assert translator._check_langs('en', 'yy') == ('en', 'auto')
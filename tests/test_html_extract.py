@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+import html_extract
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class FakeResponse:
+    """ Streamed requests response over a saved page, chunk_size is ignored to split tags at odd places """
+
+    def __init__(self, name, content_type='text/html; charset=utf-8', chunk=7):
+        with open(os.path.join(FIXTURES, name), 'rb') as f:
+            self.data = f.read()
+        self.headers = {'Content-Type': content_type}
+        self.encoding = 'utf-8' if 'charset=' in content_type else 'ISO-8859-1'  # what requests would guess
+        self.chunk = chunk
+        self.read = 0
+        self.closed = False
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.data), self.chunk):
+            self.read = min(len(self.data), start + self.chunk)
+            yield self.data[start:start + self.chunk]
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.mark.parametrize('chunk', [1, 7, 4096, 10 ** 6])
+def test_translations_split_across_chunks(chunk):
+    response = FakeResponse('reverso_context_cat.html', chunk=chunk)
+    assert html_extract.translations(response) == ['кошка', 'кот', 'кот & пёс', 'кошачийприл.']
+    assert response.closed
+
+
+def test_header_link_is_skipped():
+    assert 'Translation' not in html_extract.translations(FakeResponse('reverso_context_cat.html'))
+
+
+def test_nested_div_translation_is_one_result():
+    translations = html_extract.translations(FakeResponse('reverso_context_cat.html'))
+    assert translations[-1] == 'кошачийприл.'
+
+
+def test_entities_are_decoded():
+    assert 'кот & пёс' in html_extract.translations(FakeResponse('reverso_context_cat.html'))
+
+
+def test_missing_charset_is_read_as_utf8():
+    response = FakeResponse('reverso_context_cat.html', content_type='text/html')
+    assert html_extract.translations(response, 1) == ['кошка']
+
+
+def test_translations_stop_early(monkeypatch):
+    monkeypatch.setattr(html_extract, 'DRAIN_SIZE', 0)
+    response = FakeResponse('reverso_context_cat.html', chunk=256)
+    assert html_extract.translations(response, 1) == ['кошка']
+    assert response.read < len(response.data) / 10
+    assert response.closed
+
+
+def test_infinitive_stops_early(monkeypatch):
+    monkeypatch.setattr(html_extract, 'DRAIN_SIZE', 0)
+    response = FakeResponse('reverso_conjugator_went.html', chunk=256)
+    assert html_extract.infinitive(response) == 'go'
+    assert response.read < len(response.data) / 10
+
+
+def test_short_remainder_is_drained():
+    response = FakeResponse('reverso_conjugator_went.html', chunk=256)
+    assert html_extract.infinitive(response) == 'go'
+    assert response.read == len(response.data)  # fully read body keeps the connection
+    assert response.closed
+
+
+def test_long_remainder_is_dropped(monkeypatch):
+    monkeypatch.setattr(html_extract, 'DRAIN_SIZE', 4096)
+    response = FakeResponse('reverso_context_cat.html', chunk=256)
+    assert html_extract.translations(response, 1) == ['кошка']
+    assert response.read < len(response.data) / 10 + 4096 + 256
+    assert response.closed
+
+
+def test_no_infinitive():
+    assert html_extract.infinitive(FakeResponse('reverso_conjugator_table.html')) is None
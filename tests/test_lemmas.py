@@ -0,0 +1,31 @@
+import pytest
+
+import lemmas
+
+
+@pytest.fixture(autouse=True)
+def no_learned_forms(monkeypatch, tmp_path):
+    monkeypatch.setattr(lemmas.config, 'LEMMAS_LEARNED_FILE', str(tmp_path / 'learned.txt'))
+    monkeypatch.setattr(lemmas, '_forms', None)
+    monkeypatch.setattr(lemmas, '_infinitives', set())
+    monkeypatch.setattr(lemmas, '_irregular', set())
+
+
+@pytest.mark.parametrize('form, lemma', [('went', 'go'), ('goes', 'go'), ('does', 'do'), ('being', 'be'),
+                                         ('seeing', 'see'), ('lying', 'lie'), ('sees', 'see'), ('go', 'go')])
+def test_irregular_forms(form, lemma):
+    assert lemmas.lookup(form) == lemma
+
+
+@pytest.mark.parametrize('word', ['bed', 'seed', 'bees', 'need', 'breed'])
+def test_nouns_are_not_forms_of_irregular_verbs(word):
+    assert lemmas.lookup(word) in (None, word)
+
+
+def test_learned_regular_verb():
+    lemmas.remember('walked', 'walk')
+    assert lemmas.lookup('walking') == 'walk'
+    assert lemmas.lookup('walks') == 'walk'
+    assert lemmas.lookup('stopped') is None
+    lemmas.remember('stop', 'stop')
+    assert lemmas.lookup('stopped') == 'stop'
@@ -0,0 +1,51 @@
+import pytest
+import requests
+
+import config
+import providers
+
+
+def _http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f'{status} error', response=response)
+
+
+def _raise(error):
+    raise error
+
+
+@pytest.fixture(autouse=True)
+def closed_breaker():
+    providers.breakers['twinword'].success()
+    yield
+    providers.breakers['twinword'].success()
+
+
+def test_not_found_answers_keep_circuit_closed():
+    for error in [KeyError('example')] * config.PROVIDER_BREAKER_FAILURES + [_http_error(404)]:
+        with pytest.raises(type(error)):
+            providers.call('twinword', _raise, error)
+    assert providers.breakers['twinword'].state == 'closed'
+    assert providers.call('twinword', lambda: ['example']) == ['example']
+
+
+@pytest.mark.parametrize('error', [requests.ConnectionError('refused'), _http_error(503), _http_error(429)])
+def test_outages_open_circuit(error):
+    for _ in range(config.PROVIDER_BREAKER_FAILURES):
+        with pytest.raises(type(error)):
+            providers.call('twinword', _raise, error)
+    assert providers.breakers['twinword'].state == 'open'
+    with pytest.raises(providers.ProviderUnavailable):
+        providers.call('twinword', lambda: ['example'])
+
+
+def test_wrapped_transport_error_is_outage():
+    try:
+        try:
+            raise requests.ConnectTimeout('timed out')
+        except requests.RequestException:
+            raise ValueError('translator failed')
+    except ValueError as e:
+        assert providers.is_outage(e)
+    assert not providers.is_outage(ValueError('unknown response format'))
@@ -0,0 +1,79 @@
+"""
+ Two-level translation cache: in-process LRU in front of translation_cache table.
+ Keys are (word, direction), direction is 'en-ru' or 'ru-en'. Failed lookups are stored as None
+ and live for a shorter time than found translations.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import config
+import queries
+
+logger = logging.getLogger(__name__)
+
+MISS = object()  # returned by get() when nothing valid is cached, None means "cached as not found"
+
+_lru = OrderedDict()  # (word, direction) -> (result, expires_at)
+_lock = threading.Lock()
+_counters = {'memory_hits': 0, 'db_hits': 0, 'misses': 0}
+
+
+def _count(name):
+    with _lock:
+        _counters[name] += 1
+
+
+def _remember(key, result, ttl):
+    with _lock:
+        _lru[key] = (result, time.monotonic() + ttl)
+        _lru.move_to_end(key)
+        while len(_lru) > config.TRANSLATION_CACHE_SIZE:
+            _lru.popitem(last=False)
+
+
+def _ttl(result):
+    return config.TRANSLATION_CACHE_TTL if result is not None else config.TRANSLATION_CACHE_NEGATIVE_TTL
+
+
+def get(word: str, direction: str):
+    """ Cached translation, None for a remembered failure or MISS """
+    key = (word, direction)
+    with _lock:
+        entry = _lru.get(key)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                _lru.move_to_end(key)
+                _counters['memory_hits'] += 1
+                return entry[0]
+            del _lru[key]
+
+    try:
+        record = queries.run(queries.CACHED_TRANSLATION, word, direction,
+                             config.TRANSLATION_CACHE_TTL, config.TRANSLATION_CACHE_NEGATIVE_TTL)
+    except Exception:
+        logger.warning('Translation cache lookup failed', exc_info=True)
+        record = None
+    if record and record[0][1] > 0:
+        _remember(key, record[0][0], float(record[0][1]))
+        _count('db_hits')
+        return record[0][0]
+
+    _count('misses')
+    return MISS
+
+
+def put(word: str, direction: str, result):
+    """ Store translation or None if providers found nothing """
+    _remember((word, direction), result, _ttl(result))
+    try:
+        queries.run(queries.CACHE_TRANSLATION, word, direction, result, result is not None)
+    except Exception:
+        logger.warning('Translation cache write failed', exc_info=True)
+
+
+def stats() -> dict:
+    """ Hit/miss counters and current LRU size """
+    with _lock:
+        return dict(_counters, memory_size=len(_lru))
@@ -0,0 +1,200 @@
+"""
+ In-process vocabulary cache.
+ Per user: word -> VocabRow with effective meaning, score and review schedule, evicted by least recently active user.
+ Every user also has a heap of (due_at, word), so the most overdue word is found in O(log n).
+ Shared: word -> (meaning, examples) from the common words table, user rows refer to it by word.
+ Handlers write to Postgres first and then update the cache in place, so cached users never reload.
+"""
+import heapq
+import random
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+import config
+import db
+import queries
+
+# handlers pass due_at that the database returned, the defaults only fill rows that aren't stored yet
+VocabRow = namedtuple('VocabRow', 'word meaning score is_deleted has_examples due_at interval ease repetitions',
+                      defaults=(datetime.min, 0.0, 2.5, 0))
+
+# uid -> {'words': {word: VocabRow}, 'order': sorted not deleted words, 'due': heap of (due_at, word),
+#         'last_word': last /play word}
+_users = OrderedDict()
+_words = OrderedDict()  # word -> (meaning, examples)
+_lock = threading.RLock()
+
+
+def _load_user(uid):
+    with db.transaction() as cursor:
+        record = queries.execute(cursor, queries.USER_ROWS, uid)
+        last_word = queries.execute(cursor, queries.LAST_GAME_WORD, uid)[0][0]
+    words = {row[0]: VocabRow(*row) for row in record}
+    due = [(row.due_at, row.word) for row in words.values() if not row.is_deleted]
+    heapq.heapify(due)
+    return {'words': words, 'order': sorted(row.word for row in words.values() if not row.is_deleted), 'due': due,
+            'last_word': last_word}
+
+
+def _user(uid):
+    with _lock:
+        user = _users.get(uid)
+        if user is not None:
+            _users.move_to_end(uid)
+            return user
+    user = _load_user(uid)
+    with _lock:
+        user = _users.setdefault(uid, user)  # another thread may have loaded it meanwhile
+        _users.move_to_end(uid)
+        while len(_users) > config.VOCAB_CACHE_USERS:
+            _users.popitem(last=False)
+        return user
+
+
+def rows(uid) -> list:
+    """ Snapshot of all user rows including deleted ones """
+    user = _user(uid)
+    with _lock:
+        return list(user['words'].values())
+
+
+def row(uid, word):
+    """ User row for the word or None """
+    user = _user(uid)
+    with _lock:
+        return user['words'].get(word)
+
+
+def put(uid, word, **fields):
+    """ Create or update user row after it was written to the database. Not cached users are skipped """
+    with _lock:
+        user = _users.get(uid)
+        if user is None:
+            return
+        current = user['words'].get(word)
+        created = current is None
+        if created:
+            current = VocabRow(word, None, 0, False, False)
+        new = current._replace(**fields)
+        was_active = not created and not current.is_deleted
+        if not new.is_deleted and not was_active:
+            insort(user['order'], word)
+        elif new.is_deleted and was_active:
+            del user['order'][bisect_left(user['order'], word)]
+        user['words'][word] = new
+        if not new.is_deleted and (created or current.is_deleted or new.due_at != current.due_at):
+            heapq.heappush(user['due'], (new.due_at, word))  # older entries of the word are skipped as stale
+        if len(user['due']) > 2 * len(user['words']) + 16:
+            user['due'] = [(row.due_at, row.word) for row in user['words'].values() if not row.is_deleted]
+            heapq.heapify(user['due'])
+
+
+def playable(row) -> bool:
+    """ Word can be asked in /play """
+    return not row.is_deleted and row.has_examples and row.score <= 5
+
+
+def next_due(uid, skip=()):
+    """ Playable row with the earliest due_at, words in skip are passed over. The row stays in the queue """
+    user = _user(uid)
+    with _lock:
+        heap, words, passed, found = user['due'], user['words'], [], None
+        while heap:
+            due_at, word = heapq.heappop(heap)
+            row = words.get(word)
+            if row is None or row.due_at != due_at or not playable(row):
+                continue  # stale entry
+            passed.append((due_at, word))
+            if word not in skip:
+                found = row
+                break
+        for entry in passed:
+            heapq.heappush(heap, entry)
+        return found
+
+
+def sample(uid, count) -> list:
+    """ Random not deleted rows (with repeats) without scanning the whole vocabulary """
+    user = _user(uid)
+    with _lock:
+        order, words = user['order'], user['words']
+        return [words[random.choice(order)] for _ in range(count)] if order else []
+
+
+def active_rows(uid) -> list:
+    """ Snapshot of not deleted rows ordered by word """
+    user = _user(uid)
+    with _lock:
+        return [user['words'][word] for word in user['order']]
+
+
+def active_count(uid) -> int:
+    user = _user(uid)
+    with _lock:
+        return len(user['order'])
+
+
+def page(uid, size, after=None, before=None):
+    """
+    Keyset page of not deleted rows ordered by word: first page, page after word `after` or page before word `before`.
+    Costs a bisect and the page rows, deleted words aren't walked over.
+    :return: (rows, active words count, has previous page, has next page)
+    """
+    user = _user(uid)
+    with _lock:
+        words, order = user['words'], user['order']
+        if before is not None:
+            end = bisect_left(order, before)
+            start = max(0, end - size)
+        else:
+            start = bisect_right(order, after) if after is not None else 0
+            end = min(len(order), start + size)
+        return [words[word] for word in order[start:end]], len(order), start > 0, end < len(order)
+
+
+def last_word(uid):
+    """ Main word of the previous /play round """
+    user = _user(uid)
+    with _lock:
+        return user['last_word']
+
+
+def set_last_word(uid, word):
+    with _lock:
+        user = _users.get(uid)
+        if user is not None:
+            user['last_word'] = word
+
+
+def invalidate(uid):
+    with _lock:
+        _users.pop(uid, None)
+
+
+def _remember_word(word, meaning, examples):
+    with _lock:
+        _words[word] = (meaning, tuple(examples or ()))
+        _words.move_to_end(word)
+        while len(_words) > config.WORDS_CACHE_SIZE:
+            _words.popitem(last=False)
+
+
+def common_word(word):
+    """ (meaning, examples) from the common dictionary, None if word isn't there """
+    with _lock:
+        entry = _words.get(word)
+        if entry is not None:
+            _words.move_to_end(word)
+            return entry
+    record = queries.run(queries.COMMON_WORD, word)
+    if not record:
+        return None
+    _remember_word(word, record[0][0], record[0][1])
+    return _words.get(word) or (record[0][0], tuple(record[0][1] or ()))
+
+
+def put_common_word(word, meaning, examples):
+    """ Cache word after it was inserted into words """
+    _remember_word(word, meaning, examples)